@@ -0,0 +1,76 @@
+from cache import LRUCache
+from cube import MEASURE, RECORDS
+from data_index import selected_values
+from loader import memory_footprint
+from metrics import count, phase
+from pivot import group_sums
+
+
+class SessionAggregates:
+    # Keeps the last aggregate of every session. When the new filter state only differs from the previous one
+    # in the values of a single filter column, the previous aggregate is updated with the sums of the rows of the
+    # toggled values instead of rolling up the whole selection again.
+
+    def __init__(self, cube, index, maxsize=1024, maxbytes=0, measure=MEASURE):
+        self.cube = cube
+        self.index = index
+        self.measure = measure
+        self.sessions = LRUCache(maxsize=maxsize, maxbytes=maxbytes, sizeof=lambda entry: memory_footprint(entry[2]))
+        self.full_computations = 0
+        self.delta_computations = 0
+
+    def roll_up(self, mask, groups):
+        # Sum, records and number of cube cells by group; the number of cells tells which groups became empty
+        count("rows_scanned", int(mask.sum()))
+        return group_sums(self.cube, mask, groups, {"sum": self.measure, "records": RECORDS})
+
+    def remember(self, session_id, groups, selections, aggregate):
+        if session_id is not None:
+            self.sessions.set(session_id, (list(groups), selections, aggregate))
+
+    def selected(self, column, values):
+        # Set of the selected values found in the column (a range of years is not expanded beyond them)
+        return set(selected_values(values, self.index.values(column)))
+
+    def changed_column(self, previous, selections):
+        # Name of the only filter column whose selected values changed, or None
+        if set(previous) != set(selections):
+            return None
+        changed = [column for column in selections
+                   if self.selected(column, selections[column]) != self.selected(column, previous[column])]
+        if len(changed) != 1:
+            return None
+        return changed[0]
+
+    def delta(self, previous_selections, aggregate, groups, selections):
+        column = self.changed_column(previous_selections, selections)
+        if column is None:
+            return None
+        old, new = self.selected(column, previous_selections[column]), self.selected(column, selections[column])
+        with phase("filter"):
+            others = self.index.bits({c: v for c, v in selections.items() if c != column})
+        for values, sign in ((new - old, 1), (old - new, -1)):
+            if not values:
+                continue
+            with phase("filter"):
+                rows = self.index.to_mask(others & self.index.column_bits(column, values))
+            with phase("aggregate"):
+                aggregate = aggregate.add(sign * self.roll_up(rows, groups), fill_value=0)
+        return aggregate[aggregate["size"] > 0].astype({"size": int}).sort_index()
+
+    def aggregate(self, session_id, groups, selections):
+        # selections: {filter column: selected values}; returns the sum and number of cells by groups
+        aggregate = None
+        previous = self.sessions.get(session_id) if session_id is not None else None
+        if previous is not None and previous[0] == list(groups):
+            aggregate = self.delta(previous[1], previous[2], groups, selections)
+        if aggregate is None:
+            with phase("filter"):
+                mask = self.index.mask(selections)
+            with phase("aggregate"):
+                aggregate = self.roll_up(mask, groups)
+            self.full_computations += 1
+        else:
+            self.delta_computations += 1
+        self.remember(session_id, groups, selections, aggregate)
+        return aggregate
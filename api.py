@@ -0,0 +1,79 @@
+import gzip
+import hashlib
+import json
+
+import flask
+import pyarrow as pa
+
+from cache import encode_state, filter_state_key
+
+# Response formats of the aggregation API: mimetype
+API_FORMATS = {"json": "application/json",
+               "arrow": "application/vnd.apache.arrow.stream"}
+# Smaller responses are sent uncompressed
+GZIP_MIN_BYTES = 1024
+
+
+def request_state(args, options, seasons, years):
+    # Filter state key from the query string of /api/aggregate: variable_one, variable_two (optional: one variable),
+    # one repeated parameter per filter column (options: {column: all values}, the default), epoca, years
+    # ("2004-2020" or "2010", cut to the years of the dataset), metric and uncertainty. Raises ValueError for
+    # malformed values and for years without data.
+    variable_two = args.get("variable_two")
+    selections = [args.getlist(column) or values for column, values in options.items()]
+    year_range = [int(year) for year in args.get("years", "{}-{}".format(years[0], years[-1])).split("-")]
+    if len(year_range) not in (1, 2):
+        raise ValueError("years must be a year or a range of years")
+    # Every range that covers the same years of data is the same view (and the same cache entry)
+    year_range = [max(year_range[0], years[0]), min(year_range[-1], years[-1])]
+    if year_range[0] > year_range[1]:
+        raise ValueError("years outside the years of the dataset")
+    return filter_state_key(args.get("variable_one", "Bioregion"), variable_two is not None, variable_two, selections,
+                            args.getlist("epoca") or seasons, year_range, args.get("metric", "sum"),
+                            args.get("uncertainty", "0").lower() in ("1", "true"))
+
+
+def tidy_table(table_data, groups, column):
+    # One row per group: the crosstab of two variables is unpivoted, leaving out the pairs without records
+    if len(groups) == 1:
+        return table_data
+    return (table_data.melt(id_vars=groups[0], var_name=groups[1], value_name=column)
+            .dropna(subset=[column]).reset_index(drop=True))
+
+
+def encode_view(table, key, groups, metric, file_format):
+    # Body of the response for the table of a view, with its content hash as ETag and a gzipped copy
+    if file_format == "arrow":
+        table = pa.Table.from_pandas(table, preserve_index=False).replace_schema_metadata(
+            {"state": encode_state(key), "metric": metric})
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        body = sink.getvalue().to_pybytes()
+    else:
+        body = json.dumps({"state": encode_state(key), "variables": groups, "metric": metric,
+                           "data": json.loads(table.to_json(orient="records", force_ascii=False))},
+                          ensure_ascii=False).encode("utf-8")
+    return {"etag": hashlib.sha1(body).hexdigest(),
+            "body": body,
+            "gzip": gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None}
+
+
+def conditional_response(encoded, mimetype):
+    # 304 when the client already has this content (If-None-Match), otherwise the body, gzipped when accepted.
+    # The gzipped body is another representation, so it gets its own ETag.
+    request = flask.request
+    use_gzip = encoded["gzip"] is not None and "gzip" in request.accept_encodings
+    etag = encoded["etag"] + "-gzip" if use_gzip else encoded["etag"]
+    if etag in request.if_none_match:
+        response = flask.Response(status=304)
+    elif use_gzip:
+        response = flask.Response(encoded["gzip"], mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = flask.Response(encoded["body"], mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    # Cached by the client, but checked with the server every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
@@ -0,0 +1,81 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+
+import config
+from helpers import simple_map, two_axis_line_chart
+
+logger = logging.getLogger(__name__)
+
+# Bump when the content of the artifacts changes, so old cache files are not reused
+ARTIFACTS_VERSION = 2
+
+CHECKLIST_COLUMNS = ["Bioregion", "Subzone.name", "Island", "ORDER", "Family", "Functional.Group"]
+
+# Value cards of the methods tab: label and counted column (None counts the records)
+VALUE_CARDS = [("Registros", None),
+               ("Sitios", "Site"),
+               ("Islas", "Island"),
+               ("Especies", "ScientificName"),
+               ("Grupos funcionales", "Functional.Group")]
+
+
+def dataset_fingerprint(path, sample_bytes=1 << 20):
+    # Size, mtime and a hash of the first and last MB of the file: changes with the data, without reading all of it.
+    # The settings that change what is loaded from the file (years, columns, float storage) are part of it too.
+    stat = os.stat(path)
+    loaded = json.dumps([config.YEARS, config.DATA_COLUMNS, config.DOWNCAST_FLOATS])
+    digest = hashlib.sha1("{}:{}:{}:{}".format(ARTIFACTS_VERSION, stat.st_size, stat.st_mtime_ns,
+                                                loaded).encode("utf-8"))
+    with open(path, "rb") as f:
+        digest.update(f.read(sample_bytes))
+        if stat.st_size > sample_bytes:
+            f.seek(max(stat.st_size - sample_bytes, sample_bytes))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_artifacts(df):
+    # Everything the layout derives from the full dataset, as plain JSON values
+    return {
+        "value_cards": [[label, len(df) if column is None else len(df[column].unique())]
+                        for label, column in VALUE_CARDS],
+        "line_chart": json.loads(two_axis_line_chart(df, "year", "id", "Site", "Años", "Registros",
+                                                     "Sitios").to_json()),
+        "map": json.loads(simple_map(df, "Latitude", "Longitude", "Site", "id").to_json()),
+        "checklists": {column: sorted(df[column].dropna().unique().tolist()) for column in CHECKLIST_COLUMNS},
+        "seasons": df["epoca"].dropna().unique().tolist(),
+        "years": sorted(int(i) for i in df["year"].dropna().unique()),
+    }
+
+
+def artifacts_file(cache_dir, fingerprint):
+    return os.path.join(cache_dir, "startup-{}.json".format(fingerprint))
+
+
+def load_artifacts(path, df, cache_dir):
+    # Startup artifacts of the dataset at path, read from cache_dir or built from df and saved there
+    fingerprint = dataset_fingerprint(path)
+    cache_file = artifacts_file(cache_dir, fingerprint)
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Unreadable startup artifacts %s, rebuilding them", cache_file)
+
+    artifacts = build_artifacts(df)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_file in glob.glob(artifacts_file(cache_dir, "*")):
+            os.remove(old_file)
+        # Write then rename, so that a worker never reads a half-written file
+        tmp_file = cache_file + ".{}.tmp".format(os.getpid())
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(artifacts, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        logger.warning("Could not save startup artifacts to %s", cache_dir)
+    return artifacts
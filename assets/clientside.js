@@ -0,0 +1,37 @@
+// Clientside callbacks (registered in main.py): UI-only interactions that do not need the server
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    explorer: {
+        // "Seleccionar todo": only the checklist whose box was clicked changes, so the charts are computed once.
+        // On page load (nothing triggered) every checklist is filled.
+        select_all: function (...args) {
+            const checks = args.slice(0, 5);
+            const options = args.slice(5);
+            const ids = ["bioregion-all-checked", "zone-all-checked", "island-all-checked", "order-all-checked",
+                         "family-all-checked"];
+            const triggered = (dash_clientside.callback_context.triggered || [])
+                .map(t => t.prop_id.split(".")[0]);
+            return ids.map((id, i) => {
+                if (triggered.length && !triggered.includes(id)) {
+                    return dash_clientside.no_update;
+                }
+                return checks[i] ? options[i].map(option => option.value) : [];
+            });
+        },
+
+        toggle_second_variable: function (check) {
+            return !(check && check.length);
+        },
+
+        // Reverses the category axis of the chart sent by the server (bars are horizontal for one variable)
+        invert_chart: function (figure, invert) {
+            if (!figure) {
+                return dash_clientside.no_update;
+            }
+            const horizontal = figure.data.length > 0 && figure.data[0].orientation === "h";
+            const axis = horizontal ? "yaxis" : "xaxis";
+            const layout = Object.assign({}, figure.layout);
+            layout[axis] = Object.assign({}, layout[axis], {autorange: invert && invert.length ? "reversed" : true});
+            return Object.assign({}, figure, {layout: layout});
+        }
+    }
+});
@@ -0,0 +1,190 @@
+"""Benchmarks of the app callbacks and figure builders on synthetic survey data.
+
+    python -m benchmarks.run                        # 10k, 1M and 10M rows, compared with benchmarks/baselines.json
+    python -m benchmarks.run --sizes 10000 --save   # store the results as the new baselines
+
+Each size runs in its own process, which imports main.py on a synthetic dataset file. The exit code is 1 when a
+benchmark is slower, or allocates more, than its baseline by more than the tolerance, or has no baseline yet (record
+them with --save first). Baselines are only comparable on the machine where they were recorded.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import synthetic_survey
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_SIZES = [10_000, 1_000_000, 10_000_000]
+
+
+def measure(func, setup=None, repeat=3):
+    # Best wall time of repeat runs, and peak of memory allocated by one more run
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(times), "peak_mb": peak / 2 ** 20}
+
+
+def benchmark_cases(main):
+    # name -> (function, setup run before each measurement)
+    import helpers
+    from datasets import Dataset
+
+    dataset = main.datasets.get(main.config.DEFAULT_DATASET)
+    default_state = main.default_state(dataset.artifacts)
+    selections = default_state[0]
+    toggled = [list(selections[0]), list(selections[1]), selections[2][1:], *selections[3:]]
+    one_variable = main.get_view(dataset, main.filter_state_key("Island", False, "Family", *default_state), None)
+    two_variables = main.get_view(dataset, main.filter_state_key("Island", True, "Family", *default_state), None)
+
+    def figures(variable_one, check, variable_two, state, session_id=None, metric="sum", uncertainty=False):
+        return lambda: main.generate_figures(dataset.name, variable_one, check, variable_two, *state[0], *state[1:],
+                                             metric, [True] if uncertainty else [], session_id)
+
+    def clear():
+        dataset.figures_cache.clear()
+        dataset.session_aggregates.sessions.clear()
+
+    def prime_session():
+        clear()
+        figures("Island", False, "Family", default_state, "benchmark")()
+        dataset.figures_cache.clear()
+
+    return {
+        # First use of a dataset: loading, cube, indexes and startup artifacts (read from their cache)
+        "load_dataset": (lambda: Dataset(dataset.name, dataset.path), None),
+        "generate_figures": (figures("Island", False, "Family", default_state), clear),
+        "generate_figures_two_variables": (figures("Island", [False], "Family", default_state), clear),
+        "generate_figures_species_by_site": (figures("ScientificName", [False], "Site", default_state), clear),
+        "generate_figures_transect_mean": (figures("Family", [False], "Island", default_state,
+                                                   metric="transect_mean"), clear),
+        "generate_figures_bootstrap": (figures("Functional.Group", False, "Family", default_state,
+                                               uncertainty=True), clear),
+        "generate_figures_cached": (figures("Island", False, "Family", default_state), None),
+        "generate_figures_toggle_island": (figures("Island", False, "Family", [toggled, *default_state[1:]],
+                                                   "benchmark"), prime_session),
+        "two_axis_line_chart": (lambda: helpers.two_axis_line_chart(dataset.data, "year", "id", "Site", "Años",
+                                                                    "Registros", "Sitios"), None),
+        "simple_map": (lambda: helpers.simple_map(dataset.data, "Latitude", "Longitude", "Site", "id"), None),
+        "bar_chart_creator": (lambda: helpers.bar_chart_creator(one_variable["table_data"], "Island"), None),
+        "bivariate_bar_chart_creator": (lambda: helpers.bivariate_bar_chart_creator(two_variables["table_data"],
+                                                                                    "Island", "Family"), None),
+        "create_one_variable_table": (lambda: helpers.create_one_variable_table(one_variable["table_data"],
+                                                                                "Island"), None),
+        "create_two_variable_table": (lambda: helpers.create_two_variable_table(two_variables["table_data"],
+                                                                                "Island", "Family"), None),
+    }
+
+
+def run_worker(repeat):
+    # Runs inside the benchmark process: FISH_DATA_PATH already points to the synthetic dataset
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    start = time.perf_counter()
+    import main
+    results = {"startup": {"seconds": time.perf_counter() - start, "peak_mb": None}}
+    for name, (func, setup) in benchmark_cases(main).items():
+        results[name] = measure(func, setup, repeat)
+    print(json.dumps(results))
+
+
+def run_size(rows, repeat, data_dir):
+    path = os.path.join(data_dir, "fish-{}.feather".format(rows))
+    if not os.path.exists(path):
+        synthetic_survey(rows).to_feather(path)
+    env = dict(os.environ,
+               FISH_DATA_PATH=path,
+               FISH_DATASETS="",
+               FISH_ARTIFACTS_DIR=os.path.join(data_dir, "cache-{}".format(rows)),
+               FISH_SHARED_MEMORY="",
+               FISH_WARMUP="0")
+    output = subprocess.run([sys.executable, "-m", "benchmarks.run", "--worker", "--repeat", str(repeat)],
+                            env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            stdout=subprocess.PIPE, check=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def missing_baselines(results, baselines):
+    return ["{} rows, {}".format(size, name) for size, benchmarks in results.items() for name in benchmarks
+            if name not in baselines.get(size, {})]
+
+
+def regressions(results, baselines, tolerance):
+    found = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            baseline = baselines.get(size, {}).get(name)
+            if baseline is None:
+                continue
+            for metric in ("seconds", "peak_mb"):
+                if result[metric] is not None and baseline.get(metric) and \
+                        result[metric] > baseline[metric] * (1 + tolerance):
+                    found.append("{} rows, {}: {} {:.4g} > baseline {:.4g}".format(
+                        size, name, metric, result[metric], baseline[metric]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the data explorer on synthetic survey data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="rows of the synthetic datasets")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark (the best time is kept)")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown or memory growth over the baseline (0.5 = 50%%)")
+    parser.add_argument("--baselines", default=BASELINES_FILE)
+    parser.add_argument("--save", action="store_true", help="store these results as the baselines")
+    parser.add_argument("--data-dir", help="folder for the synthetic datasets (default: a temporary folder)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        run_worker(args.repeat)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        results = {}
+        for rows in args.sizes:
+            results[str(rows)] = run_size(rows, args.repeat, data_dir)
+            for name, result in results[str(rows)].items():
+                peak = "" if result["peak_mb"] is None else "{:10.1f} MB".format(result["peak_mb"])
+                print("{:>10} rows  {:<36}{:10.4f} s{}".format(rows, name, result["seconds"], peak))
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as f:
+            baselines = json.load(f)
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print("Baselines saved to", args.baselines)
+        return 0
+
+    # A benchmark without baseline fails too: otherwise a new benchmark, or a run on another machine, passes
+    # without comparing anything
+    missing = missing_baselines(results, baselines)
+    for benchmark in missing:
+        print("NO BASELINE", benchmark, "(record it with --save)")
+    found = regressions(results, baselines, args.tolerance)
+    for regression in found:
+        print("REGRESSION", regression)
+    return 1 if found or missing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+def names(prefix, count):
+    return ["{} {}".format(prefix, i + 1) for i in range(count)]
+
+
+def synthetic_survey(rows, sites=120, islands=14, subzones=30, bioregions=5, species=400, families=80, orders=25,
+                     functional_groups=10, first_year=2004, last_year=2020, seed=0):
+    # Fish survey records with the schema of the app dataset. Sites belong to one island, subzone and bioregion,
+    # and species to one family, order and functional group, like in the real data.
+    rng = np.random.default_rng(seed)
+
+    site_island = rng.integers(0, islands, sites)
+    site_subzone = rng.integers(0, subzones, sites)
+    site_bioregion = site_island % bioregions
+    site_latitude = rng.uniform(-1.5, 0.7, sites)
+    site_longitude = rng.uniform(-92.0, -89.2, sites)
+    species_family = rng.integers(0, families, species)
+    family_order = rng.integers(0, orders, families)
+    species_group = rng.integers(0, functional_groups, species)
+
+    # A few sites and species concentrate most of the records
+    site = np.minimum(rng.zipf(1.3, rows) - 1, sites - 1) if sites > 1 else np.zeros(rows, dtype=int)
+    site = rng.permutation(sites)[site]
+    specie = np.minimum(rng.zipf(1.2, rows) - 1, species - 1) if species > 1 else np.zeros(rows, dtype=int)
+    specie = rng.permutation(species)[specie]
+    year = rng.integers(first_year, last_year + 1, rows)
+
+    def categorical(codes, categories):
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "Bioregion": categorical(site_bioregion[site], names("Bioregión", bioregions)),
+        "Subzone.name": categorical(site_subzone[site], names("Zona", subzones)),
+        "Island": categorical(site_island[site], names("Isla", islands)),
+        "Site": categorical(site, names("Sitio", sites)),
+        "Latitude": site_latitude[site],
+        "Longitude": site_longitude[site],
+        "ORDER": categorical(family_order[species_family[specie]], names("Orden", orders)),
+        "Family": categorical(species_family[specie], names("Familia", families)),
+        "ScientificName": categorical(specie, names("Especie", species)),
+        "Functional.Group": categorical(species_group[specie], names("Grupo", functional_groups)),
+        "epoca": categorical(rng.integers(0, 2, rows), ["Caliente", "Fría"]),
+        "year": year,
+        "Biomass.250m2": np.round(rng.lognormal(3.0, 1.5, rows), 2),
+    })
+    # Survey exports are ordered by date
+    return df.sort_values("year", kind="stable").reset_index(drop=True)
@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+from pivot import group_sums
+
+# Resampled (group, transect) draws held in memory at once by a batch of resamples
+BATCH_DRAWS = 5_000_000
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def transect_totals(cube, mask, groups, measure, transect):
+    # Total of the measure by group and transect over the masked cells (transects with records only), in one
+    # bincount pass. Returns the group index (same order as the aggregates), the group number of every
+    # (group, transect) pair and its total; the pairs are sorted by group.
+    frame = pd.DataFrame({column: cube[column][mask] for column in groups + [measure]})
+    frame["transect"] = transect[mask]
+    totals = group_sums(frame, slice(None), groups + ["transect"], {"value": measure})
+    pairs = totals.index.droplevel("transect")
+    group_index = pairs.unique()
+    return group_index, group_index.get_indexer(pairs), totals["value"].to_numpy()
+
+
+def resample(values, starts, nonzero, transects, n_resamples, seed):
+    # Bootstrap totals (n_resamples x groups): every group draws its number of transects with replacement.
+    # Transects without records are 0, so only the number of draws that land on a transect with records is drawn
+    # (binomial), and then which ones; all the groups of the batch are drawn together.
+    rng = np.random.default_rng(seed)
+    n_groups = len(starts)
+    hits = rng.binomial(transects.astype(np.int64), np.divide(nonzero, transects, out=np.zeros(n_groups),
+                                                              where=transects > 0), size=(n_resamples, n_groups))
+    owner = np.repeat(np.arange(n_resamples * n_groups), hits.ravel())
+    group = owner % n_groups
+    draws = starts[group] + (rng.random(len(owner)) * nonzero[group]).astype(np.int64)
+    totals = np.bincount(owner, weights=values[draws], minlength=n_resamples * n_groups)
+    return totals.reshape(n_resamples, n_groups)
+
+
+def start_pool():
+    # Forks the workers of the app process, while it has no other thread yet (a process forked from a threaded one
+    # can inherit locks held by the other threads). The workers share the memory of the app instead of importing it
+    # again, so there is no pool where fork is missing; processes forked later (the background jobs, see main.py)
+    # don't use this one and resample by themselves.
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None and config.BOOTSTRAP_WORKERS > 1 and "fork" in multiprocessing.get_all_start_methods():
+            _pool = ProcessPoolExecutor(max_workers=config.BOOTSTRAP_WORKERS,
+                                        mp_context=multiprocessing.get_context("fork"))
+            # All the forked workers start with the first task
+            _pool.submit(int).result()
+            _pool_pid = os.getpid()
+
+
+def get_pool():
+    # Pool of workers started by this process, or None
+    return _pool if _pool_pid == os.getpid() else None
+
+
+def bootstrap_totals(values, pair_groups, transects, n_resamples=1000, seed=0):
+    # Bootstrap distribution of the group totals (n_resamples x groups), in batches that fit BATCH_DRAWS and run
+    # in the process pool when there is more than one batch and one (see start_pool)
+    nonzero = np.bincount(pair_groups, minlength=len(transects)).astype(np.float64)
+    starts = (np.cumsum(nonzero) - nonzero).astype(np.int64)
+    batch = int(max(1, min(n_resamples, BATCH_DRAWS // max(len(values), 1))))
+    sizes = [min(batch, n_resamples - start) for start in range(0, n_resamples, batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    arguments = [(values, starts, nonzero, transects, size, batch_seed) for size, batch_seed in zip(sizes, seeds)]
+    pool = get_pool()
+    if len(arguments) > 1 and pool is not None:
+        results = list(pool.map(resample, *zip(*arguments)))
+    else:
+        results = [resample(*batch_arguments) for batch_arguments in arguments]
+    return np.concatenate(results)
+
+
+def confidence_intervals(cube, mask, groups, measure, transect, transects, per_transect=False, area=1,
+                         level=0.95, n_resamples=1000, seed=0):
+    # Bounds of the total of the measure by group (or of its mean per transect, and per unit of area), by
+    # resampling the transects of every group. transect: transect of every cube cell; transects: function that
+    # returns the number of transects sampled for each group of a group index (see measures.EffortIndex).
+    group_index, pair_groups, values = transect_totals(cube, mask, groups, measure, transect)
+    if len(group_index) == 0:
+        # Nothing selected: no groups to resample
+        return pd.DataFrame({"lower": [], "upper": []}, index=group_index, dtype=np.float64)
+    n_transects = np.asarray(transects(group_index), dtype=np.float64)
+    totals = bootstrap_totals(values, pair_groups, n_transects, n_resamples, seed)
+    if per_transect:
+        totals = totals / n_transects
+    alpha = (1 - level) / 2
+    lower, upper = np.quantile(totals / area, [alpha, 1 - alpha], axis=0)
+    return pd.DataFrame({"lower": lower, "upper": upper}, index=group_index)
@@ -0,0 +1,105 @@
+import base64
+import json
+import threading
+from collections import OrderedDict
+
+
+def normalize_selection(values):
+    # Checklist values arrive as lists in click order: compare them as sorted sets
+    if values is None:
+        return ()
+    if isinstance(values, (list, tuple, set, frozenset)):
+        return tuple(sorted(set(values), key=str))
+    return (values,)
+
+
+def filter_state_key(variable_one, check, variable_two, selections, season, year_range, metric="sum",
+                     uncertainty=False):
+    # Canonical form of the chart controls: the same view always gets the same key
+    check = bool(check)
+    return (variable_one,
+            check,
+            variable_two if check else None,
+            tuple(normalize_selection(selection) for selection in selections),
+            normalize_selection(season),
+            (year_range[0], year_range[-1]),
+            metric,
+            bool(uncertainty))
+
+
+def encode_state(key):
+    # URL-safe token of a filter state key (see decode_state)
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_state(token):
+    # Raises ValueError when the token is not a filter state key (links and API calls come from outside the app)
+    values = json.loads(base64.urlsafe_b64decode(token))
+    if not isinstance(values, list) or not 6 <= len(values) <= 8 or not isinstance(values[3], list) \
+            or len(values[3]) != 5 or not isinstance(values[5], list) or len(values[5]) not in (1, 2):
+        raise ValueError("Malformed filter state")
+    return filter_state_key(*values)
+
+
+class LRUCache:
+    # Thread-safe mapping bounded to maxsize entries, and to maxbytes bytes of values as measured by sizeof (0: no
+    # limit); the least recently used entry is evicted first
+
+    def __init__(self, maxsize=128, maxbytes=0, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        size = int(self.sizeof(value)) if self.sizeof is not None else 0
+        with self._lock:
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (self.maxbytes and self.nbytes > self.maxbytes
+                                                      and len(self._data) > 1):
+                evicted, _ = self._data.popitem(last=False)
+                self.nbytes -= self._sizes.pop(evicted)
+
+    def get_or_compute(self, key, func):
+        # The computation runs outside the lock: two requests for the same new key may both compute it
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize,
+                "bytes": self.nbytes, "maxbytes": self.maxbytes}
@@ -0,0 +1,77 @@
+import os
+
+# Dataset file (Arrow/Feather, or Parquet written by ingest.py), overridable with the FISH_DATA_PATH environment
+# variable
+DATA_PATH = os.environ.get("FISH_DATA_PATH",
+                           r"C:\Users\juancarlos.izurieta\PycharmProjects\KnowingMoreMarine\data\fish.feather")
+
+# Survey datasets offered in the app as "name=path" entries separated by ";", e.g.
+# FISH_DATASETS="fish=/data/fish.feather;invertebrates=/data/invertebrates.feather" (same columns as DATA_COLUMNS).
+# The first one is shown on page load; by default the only dataset is DATA_PATH
+DATASETS = dict(entry.split("=", 1) for entry in os.environ["FISH_DATASETS"].split(";") if entry) \
+    if os.environ.get("FISH_DATASETS") else {"fish": DATA_PATH}
+DEFAULT_DATASET = next(iter(DATASETS))
+# Names shown in the dataset selector (other datasets show their name)
+DATASET_LABELS = {"fish": "Peces", "invertebrates": "Macroinvertebrados"}
+# Memory of the loaded datasets and their cubes (MB, 0: no limit): above it the least recently used are unloaded
+DATASETS_MEMORY_MB = int(os.environ.get("FISH_DATASETS_MEMORY_MB", 0))
+
+# Name of the shared memory segment published by `python shared.py` for the first dataset (empty: every process
+# loads the dataset)
+SHARED_MEMORY_NAME = os.environ.get("FISH_SHARED_MEMORY", "")
+
+# Columns read from the dataset: the ones used by the layout and the callbacks
+DATA_COLUMNS = ["id", "Bioregion", "Subzone.name", "Island", "Site", "Latitude", "Longitude", "ORDER", "Family",
+                "ScientificName", "Functional.Group", "epoca", "year", "Biomass.250m2"]
+
+# Years loaded from the dataset, e.g. "2010-2019" (empty: all). Files written by loader.write_partitioned have one
+# record batch per year, and only the batches of these years are read. This is a startup setting: the loaded years
+# stay in memory and each query slices them, no batches are read per query
+YEARS = tuple(int(year) for year in os.environ["FISH_YEARS"].split("-")) if os.environ.get("FISH_YEARS") else None
+
+# Store biomass as float32 when rounding to 2 decimals is still exact enough (totals are summed as float64)
+DOWNCAST_FLOATS = os.environ.get("FISH_DOWNCAST_FLOATS", "1") == "1"
+
+# Cache sizes (number of entries)
+FIGURES_CACHE_SIZE = int(os.environ.get("FISH_FIGURES_CACHE_SIZE", 256))
+SESSIONS_CACHE_SIZE = int(os.environ.get("FISH_SESSIONS_CACHE_SIZE", 1024))
+# Memory of the caches of each dataset (views, session aggregates and API responses, MB): the oldest entries are
+# dropped above it, and it is counted in the memory of the dataset for DATASETS_MEMORY_MB
+CACHES_MEMORY_MB = int(os.environ.get("FISH_CACHES_MEMORY_MB", 64))
+
+# Image export: number of warm kaleido renderers and number of PNGs kept in memory
+EXPORT_RENDERERS = int(os.environ.get("FISH_EXPORT_RENDERERS", 1))
+EXPORT_CACHE_SIZE = int(os.environ.get("FISH_EXPORT_CACHE_SIZE", 32))
+
+# Rows per page of the tables (paging, sorting and filtering run on the server)
+TABLE_PAGE_SIZE = int(os.environ.get("FISH_TABLE_PAGE_SIZE", 25))
+
+# Folder for the startup artifacts computed from the dataset (value cards, methods charts, control options)
+ARTIFACTS_DIR = os.environ.get("FISH_ARTIFACTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# Profiling of the callbacks: "" (off), "cprofile" or "pyinstrument", the fraction of calls sampled
+# and the folder for the reports
+PROFILER = os.environ.get("FISH_PROFILER", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("FISH_PROFILE_SAMPLE_RATE", 0.01))
+PROFILE_DIR = os.environ.get("FISH_PROFILE_DIR", "profiles")
+
+# Charts show the top N categories (and top N series in the bivariate chart, one per palette color),
+# the rest is added up in "Otros"
+CHART_TOP_N = int(os.environ.get("FISH_CHART_TOP_N", 20))
+CHART_TOP_N_COLUMNS = int(os.environ.get("FISH_CHART_TOP_N_COLUMNS", 14))
+
+# Confidence intervals of the charts: bootstrap resamples of the transects, and processes used for large
+# selections by every app process (0 or 1: resample in the app process). Keep it low with several app workers.
+BOOTSTRAP_RESAMPLES = int(os.environ.get("FISH_BOOTSTRAP_RESAMPLES", 1000))
+BOOTSTRAP_WORKERS = int(os.environ.get("FISH_BOOTSTRAP_WORKERS", min(2, os.cpu_count() or 1)))
+
+# Charts computed as Dash background jobs (needs dash[diskcache]): a newer request of the same page stops the job
+# still running, and every job waits BACKGROUND_DEBOUNCE seconds first, so a burst of changes computes only the last
+BACKGROUND_CALLBACKS = os.environ.get("FISH_BACKGROUND_CALLBACKS", "0") == "1"
+BACKGROUND_DEBOUNCE = float(os.environ.get("FISH_BACKGROUND_DEBOUNCE", 0.3))
+BACKGROUND_CACHE_DIR = os.environ.get("FISH_BACKGROUND_CACHE_DIR", os.path.join(ARTIFACTS_DIR, "jobs"))
+
+# Views computed at startup: the default view for every chart variable, and the WARMUP_STATES filter states most
+# requested (logged in ARTIFACTS_DIR across restarts); FISH_WARMUP=0 turns the warm-up off
+WARMUP = os.environ.get("FISH_WARMUP", "1") == "1"
+WARMUP_STATES = int(os.environ.get("FISH_WARMUP_STATES", 20))
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from data_index import FILTER_COLUMNS, dimension_columns, sort_partitions
+
+MEASURE = "Biomass.250m2"
+# Number of dataset records in each cell of the cube
+RECORDS = "records"
+
+
+def cube_dimensions(df):
+    # Filter columns plus every column offered in the chart dropdowns
+    dimensions = list(FILTER_COLUMNS)
+    dimensions += [column for column in dimension_columns(df) if column not in dimensions]
+    return dimensions
+
+
+def build_cube(df, dimensions=None, measure=MEASURE):
+    # Sum of the measure and number of records for every observed combination of the dimensions.
+    # Empty combinations are simply not stored, so the cube only grows with the distinct combinations
+    # and any chart of the tab can be answered by rolling it up.
+    if dimensions is None:
+        dimensions = cube_dimensions(df)
+    # Totals are always accumulated as float64, even if the dataset stores the measure as float32
+    grouped = df[measure].astype("float64").groupby([df[column] for column in dimensions],
+                                                    observed=True, dropna=False, sort=False)
+    cube = pd.DataFrame({measure: grouped.sum(), RECORDS: grouped.size()}).reset_index()
+    # Keep the categories of the source so codes and options stay consistent with the dataset
+    for column in dimensions:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            cube[column] = cube[column].astype(df[column].dtype)
+    # Cells of the same year are contiguous, like the rows of the dataset
+    return sort_partitions(cube)
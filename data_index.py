@@ -0,0 +1,226 @@
+import numpy as np
+import pandas as pd
+
+# Columns filtered by the controls of the charts tab (same order as the callback inputs)
+FILTER_COLUMNS = ["Bioregion", "Subzone.name", "Island", "ORDER", "Family", "epoca", "year"]
+# The dataset and the cube are kept sorted by this column, so a range of its values is a contiguous slice of rows
+PARTITION_COLUMN = "year"
+
+
+def dimension_columns(df):
+    # Text columns offered as metrics in the chart dropdowns
+    return list(df.select_dtypes(["object", "category"]).columns)
+
+
+def prepare_data(df):
+    # Keep every text column as an integer-coded categorical: smaller in memory and cheap to group by
+    for column in dimension_columns(df):
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    return df
+
+
+def column_codes(series):
+    # Integer codes (-1 for missing values) and the value for each code
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories.tolist()
+    codes, uniques = pd.factorize(series, sort=True)
+    return codes, uniques.tolist()
+
+
+def sort_partitions(df, column=PARTITION_COLUMN):
+    # Rows ordered by the partition column (stable, so the order inside each partition is kept)
+    if column not in df or df[column].is_monotonic_increasing:
+        return df
+    return df.sort_values(column, kind="stable", ignore_index=True)
+
+
+def selected_values(values, available):
+    # The values of available that are selected. A range (the years of the slider, see main.key_selections) is
+    # compared by its bounds, whatever its length.
+    if isinstance(values, range):
+        return [value for value in available if values.start <= value < values.stop]
+    return values or []
+
+
+class PartitionOffsets:
+    # Offset table of a column the frame is sorted by: the rows of values[i] are offsets[i]:offsets[i + 1]
+
+    def __init__(self, series):
+        array = series.to_numpy()
+        self.values, starts = np.unique(array, return_index=True)
+        self.offsets = np.append(starts, len(array))
+
+    @staticmethod
+    def usable(series):
+        return series.is_monotonic_increasing and not series.isna().any()
+
+    def span(self, low, high):
+        # Rows with low <= value <= high, found by binary search on the offset table
+        start = np.searchsorted(self.values, low, side="left")
+        stop = np.searchsorted(self.values, high, side="right")
+        return int(self.offsets[start]), int(self.offsets[stop])
+
+    def spans(self, values):
+        # Row ranges of the selected values, with consecutive partitions merged into one range. A range of values is
+        # one slice, found by binary search.
+        if isinstance(values, range):
+            start, stop = self.span(values.start, values.stop - 1) if len(values) else (0, 0)
+            return [(start, stop)] if stop > start else []
+        positions = np.unique(np.searchsorted(self.values, [value for value in values if value in self]))
+        spans = []
+        for position in positions.tolist():
+            start, stop = int(self.offsets[position]), int(self.offsets[position + 1])
+            if spans and spans[-1][1] == start:
+                spans[-1] = (spans[-1][0], stop)
+            else:
+                spans.append((start, stop))
+        return spans
+
+    def __contains__(self, value):
+        position = np.searchsorted(self.values, value)
+        return position < len(self.values) and self.values[position] == value
+
+
+def range_bits(n_bytes, spans):
+    # Packed bitmap (same layout as np.packbits) with the rows of the spans set
+    bits = np.zeros(n_bytes, dtype=np.uint8)
+    for start, stop in spans:
+        first_byte, last_byte = (start + 7) // 8, stop // 8
+        if last_byte > first_byte:
+            bits[first_byte:last_byte] = 255
+        # Partial bytes at both ends
+        for row in range(start, min(stop, first_byte * 8)):
+            bits[row >> 3] |= 0x80 >> (row & 7)
+        for row in range(max(start, first_byte * 8, last_byte * 8), stop):
+            bits[row >> 3] |= 0x80 >> (row & 7)
+    return bits
+
+
+class FilterIndex:
+    # One packed bitmap (1 bit per row) per value of every filter column.
+    # A selection is resolved by OR-ing the bitmaps of the selected values inside each column
+    # and AND-ing the columns together, without touching the dataset itself.
+    # When the frame is sorted by the partition column, that column has an offset table instead of bitmaps
+    # and its selections become row ranges.
+
+    def __init__(self, df, columns=FILTER_COLUMNS, partition_column=PARTITION_COLUMN):
+        self.n_rows = len(df)
+        self.n_bytes = (self.n_rows + 7) // 8
+        self.bitmaps = {}
+        self.complete = {}
+        self.partitions = None
+        if partition_column in columns and PartitionOffsets.usable(df[partition_column]):
+            self.partition_column = partition_column
+            self.partitions = PartitionOffsets(df[partition_column])
+            self.complete[partition_column] = True
+        for column in columns:
+            if self.partitions is not None and column == self.partition_column:
+                continue
+            codes, values = column_codes(df[column])
+            self.bitmaps[column] = {value: np.packbits(codes == code) for code, value in enumerate(values)}
+            # Selecting every value of a column without missing values is a no-op for that column
+            self.complete[column] = not (codes == -1).any()
+
+    def memory(self):
+        # Bytes of the bitmaps
+        return sum(bits.nbytes for bitmaps in self.bitmaps.values() for bits in bitmaps.values())
+
+    def values(self, column):
+        if self.partitions is not None and column == self.partition_column:
+            return self.partitions.values.tolist()
+        return list(self.bitmaps[column])
+
+    def column_bits(self, column, values):
+        if self.partitions is not None and column == self.partition_column:
+            return range_bits(self.n_bytes, self.partitions.spans(values))
+        bitmaps = self.bitmaps[column]
+        bits = np.zeros(self.n_bytes, dtype=np.uint8)
+        for value in selected_values(values, bitmaps):
+            value_bits = bitmaps.get(value)
+            if value_bits is not None:
+                np.bitwise_or(bits, value_bits, out=bits)
+        return bits
+
+    def bits(self, selections):
+        # selections: {column: selected values}; columns not given are not filtered
+        result = None
+        for column, values in selections.items():
+            available = self.values(column)
+            if isinstance(values, range):
+                everything = len(selected_values(values, available)) == len(available)
+            else:
+                values = set(values or [])
+                everything = values.issuperset(available)
+            if self.complete[column] and everything:
+                continue
+            bits = self.column_bits(column, values)
+            result = bits if result is None else np.bitwise_and(result, bits, out=result)
+            if not result.any():
+                break
+        if result is None:
+            result = np.full(self.n_bytes, 255, dtype=np.uint8)
+        return result
+
+    def to_mask(self, bits):
+        return np.unpackbits(bits, count=self.n_rows).view(bool)
+
+    def mask(self, selections):
+        # Boolean row mask for the selections
+        return self.to_mask(self.bits(selections))
+
+
+def selection_mask(df, selections, partitions=None, partition_column=PARTITION_COLUMN):
+    # Row mask of the selections computed on the column codes, for frames without a FilterIndex.
+    # With the partition offsets of df, only the rows of the selected partitions are looked at.
+    if partitions is not None and partition_column in selections:
+        mask = np.zeros(len(df), dtype=bool)
+        others = {column: values for column, values in selections.items() if column != partition_column}
+        for start, stop in partitions.spans(selections[partition_column] or []):
+            mask[start:stop] = selection_mask(df.iloc[start:stop], others)
+        return mask
+    mask = np.ones(len(df), dtype=bool)
+    for column, values in selections.items():
+        codes, column_values = column_codes(df[column])
+        positions = {value: i for i, value in enumerate(column_values)}
+        # One extra slot at the end so that missing values (code -1) are never selected
+        lookup = np.zeros(len(column_values) + 1, dtype=bool)
+        lookup[[positions[value] for value in selected_values(values, column_values) if value in positions]] = True
+        mask &= lookup[codes]
+    return mask
+
+
+class CooccurrenceIndex:
+    # For every pair of filter columns, which values appear together in at least one row, as a boolean matrix
+    # (values of the first column x values of the second). The options still possible in a column are those
+    # that co-occur with a selected value of each of the other filtered columns: a few row lookups and ANDs,
+    # whatever the size of the dataset.
+
+    def __init__(self, df, columns=FILTER_COLUMNS):
+        codes = {}
+        self.values = {}
+        self.positions = {}
+        for column in columns:
+            codes[column], self.values[column] = column_codes(df[column])
+            self.positions[column] = {value: i for i, value in enumerate(self.values[column])}
+        self.pairs = {}
+        for a in columns:
+            for b in columns:
+                if a == b:
+                    continue
+                n_a, n_b = len(self.values[a]), len(self.values[b])
+                present = (codes[a] >= 0) & (codes[b] >= 0)
+                matrix = np.zeros(n_a * n_b, dtype=bool)
+                matrix[np.unique(codes[a][present].astype(np.int64) * n_b + codes[b][present])] = True
+                self.pairs[a, b] = matrix.reshape(n_a, n_b)
+
+    def options(self, column, selections):
+        # Values of column compatible with the selections {other column: selected values}
+        allowed = np.ones(len(self.values[column]), dtype=bool)
+        for other, values in selections.items():
+            if other == column or (other, column) not in self.pairs:
+                continue
+            positions = self.positions[other]
+            selected = [positions[value] for value in selected_values(values, self.values[other]) if value in positions]
+            allowed &= self.pairs[other, column][selected].any(axis=0)
+        return [value for value, keep in zip(self.values[column], allowed) if keep]
@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from aggregation import SessionAggregates
+from artifacts import load_artifacts
+from cache import LRUCache
+from cube import build_cube
+from data_index import (FILTER_COLUMNS, PARTITION_COLUMN, CooccurrenceIndex, FilterIndex, PartitionOffsets,
+                        dimension_columns)
+from loader import load_dataset, memory_footprint
+from measures import EffortIndex
+from metrics import count
+from shared import attach_frame, cube_segment_name
+from spatial import SpatialIndex
+from warmup import StateLog
+
+logger = logging.getLogger(__name__)
+
+# Estimated memory of the chart and the first table page of a cached view (bytes)
+VIEW_OVERHEAD = 32 * 2 ** 10
+
+
+class Dataset:
+    # A survey dataset with its cube, indexes and caches: everything the callbacks read for it
+
+    def __init__(self, name, path, shared_memory_name=""):
+        self.name = name
+        self.path = path
+        # Startup artifacts and the log of requested views of every dataset go to their own folder
+        self.directory = os.path.join(config.ARTIFACTS_DIR, name)
+        # With a shared memory name, the dataset and its cube are attached from the shared memory published by
+        # `python shared.py`, instead of every worker loading its own copy
+        if shared_memory_name:
+            self.data = attach_frame(shared_memory_name)
+            self.cube = attach_frame(cube_segment_name(shared_memory_name))
+        else:
+            self.data = load_dataset(path)
+            # Biomass pre-aggregated over every filter and chart variable: the charts tab only reads from here
+            self.cube = build_cube(self.data)
+        self.variable_columns = dimension_columns(self.data)
+        # Row range of every year in the dataset (sorted by year), for the raw records downloads
+        self.partitions = PartitionOffsets(self.data[PARTITION_COLUMN]) \
+            if PartitionOffsets.usable(self.data[PARTITION_COLUMN]) else None
+        # Value cards, methods charts and control options, cached on disk until the dataset file changes
+        self.artifacts = load_artifacts(path, self.data, self.directory)
+
+        self.filter_index = FilterIndex(self.cube, FILTER_COLUMNS)
+        # Values of each filter that appear together, to narrow the checklists to the possible options
+        self.cooccurrence_index = CooccurrenceIndex(self.cube, FILTER_COLUMNS)
+        # Survey points binned by zoom level for the biomass map
+        self.spatial_index = SpatialIndex(self.data)
+        self.map_center = {"lat": float(np.mean(self.spatial_index.lat)),
+                           "lon": float(np.mean(self.spatial_index.long))}
+        # Transects sampled in the filtered area and period, for the metrics normalized by sampling effort
+        self.effort_index = EffortIndex(self.cube, self.filter_index)
+
+        # The caches share CACHES_MEMORY_MB: half for the views, a quarter for the sessions and for the API
+        caches_memory = config.CACHES_MEMORY_MB * 2 ** 20
+        # Charts and tables already built, by filter state
+        self.figures_cache = LRUCache(maxsize=config.FIGURES_CACHE_SIZE, maxbytes=caches_memory // 2,
+                                      sizeof=view_memory)
+        # Last aggregate of each browser session, updated incrementally when a single filter changes
+        self.session_aggregates = SessionAggregates(self.cube, self.filter_index, maxsize=config.SESSIONS_CACHE_SIZE,
+                                                    maxbytes=caches_memory // 4)
+        # Encoded responses of the aggregation API, by filter state and format
+        self.api_responses = LRUCache(maxsize=config.FIGURES_CACHE_SIZE, maxbytes=caches_memory // 4,
+                                      sizeof=lambda encoded: len(encoded["body"]) + len(encoded["gzip"] or b""))
+        # Filter states requested by the users, replayed by the warm-up of the next start
+        self.state_log = StateLog(os.path.join(self.directory, "states.json"))
+
+        # Counted against the memory budget of the registry: the data, the cube, the indexes and the memory allowed
+        # to the caches
+        self.memory = (memory_footprint(self.data) + memory_footprint(self.cube) + self.filter_index.memory() +
+                       self.spatial_index.memory() + caches_memory)
+
+
+def view_memory(view):
+    # Table data and aggregate of a cached view, plus the estimate of its chart and table
+    return memory_footprint(view["table_data"]) + memory_footprint(view["aggregate"]) + VIEW_OVERHEAD
+
+
+class DatasetRegistry:
+    # Datasets by name ({name: path}), loaded on first use. When the loaded datasets take more than memory_budget
+    # bytes, the least recently used ones are unloaded (a callback still reading one keeps it until it finishes)
+    # and loaded again the next time they are requested.
+
+    def __init__(self, paths, memory_budget=0, shared_memory=None):
+        self.paths = paths
+        self.memory_budget = memory_budget
+        self.shared_memory = shared_memory or {}
+        self.loaded = OrderedDict()
+        self._lock = threading.Lock()
+        # Loading takes seconds: one lock per dataset, so the loaded ones keep being served meanwhile
+        self._loading = {name: threading.Lock() for name in paths}
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def get(self, name):
+        with self._lock:
+            dataset = self.loaded.get(name)
+            if dataset is not None:
+                self.loaded.move_to_end(name)
+                return dataset
+        with self._loading[name]:
+            with self._lock:
+                dataset = self.loaded.get(name)
+            if dataset is None:
+                count("dataset_loads")
+                dataset = Dataset(name, self.paths[name], self.shared_memory.get(name, ""))
+                logger.info("Dataset %s loaded: %.1f MB with its cube and caches", name, dataset.memory / 2 ** 20)
+            with self._lock:
+                self.loaded[name] = dataset
+                self.loaded.move_to_end(name)
+                self.evict(keep=name)
+        return dataset
+
+    def evict(self, keep):
+        # Called with the lock held: unloads the least recently used datasets, except keep, until within budget
+        while self.memory_budget and len(self.loaded) > 1 and \
+                sum(dataset.memory for dataset in self.loaded.values()) > self.memory_budget:
+            name = next(name for name in self.loaded if name != keep)
+            dataset = self.loaded.pop(name)
+            dataset.state_log.save()
+            logger.info("Dataset %s unloaded to stay within %.0f MB", name, self.memory_budget / 2 ** 20)
+
+    def save_state_logs(self):
+        for dataset in list(self.loaded.values()):
+            dataset.state_log.save()
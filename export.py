@@ -0,0 +1,83 @@
+import hashlib
+import json
+import logging
+import queue
+import threading
+
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from cache import LRUCache
+from helpers import expand_typed_arrays
+
+try:
+    from kaleido.scopes.plotly import PlotlyScope
+except ImportError:  # kaleido missing, or a version without scopes: plotly.io renders with its own engine
+    PlotlyScope = None
+
+logger = logging.getLogger(__name__)
+
+
+def figure_hash(figure):
+    return hashlib.sha1(json.dumps(figure, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def chart_file_name(figure, extension=".png"):
+    # The bold part of the chart title, e.g. "Biomasa por bioregion.png"
+    title = figure["layout"]["title"]["text"]
+    start = title.index("<b>") + len("<b>")
+    return title[start:title.index("</b>")] + extension
+
+
+def new_renderer():
+    # Kaleido process of its own, configured like the one plotly.io uses
+    default = getattr(getattr(pio, "kaleido", None), "scope", None)
+    if PlotlyScope is None or default is None:
+        return None
+    return PlotlyScope(plotlyjs=default.plotlyjs, mathjax=default.mathjax)
+
+
+class ImageExporter:
+    # Renders figures to PNG bytes in memory on a pool of kaleido processes that are started once and reused.
+    # Each rendered image is cached by the hash of its figure, so downloading the same view again is free.
+
+    def __init__(self, renderers=1, cache_size=32):
+        self.size = max(renderers, 1)
+        self.renderers = queue.Queue()
+        self.cache = LRUCache(maxsize=cache_size)
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Start the kaleido processes (a first render is what launches them)
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            try:
+                renderer = new_renderer()
+                if renderer is not None:
+                    renderer.transform(go.Figure().to_dict(), format="png")
+            except Exception:
+                # A renderer that cannot start is replaced by plotly.io, so render() never waits for it forever
+                logger.exception("Could not start a kaleido renderer, using plotly.io instead")
+                renderer = None
+            self.renderers.put(renderer)
+
+    def start_in_background(self):
+        threading.Thread(target=self.start, name="image-export-warm-up", daemon=True).start()
+
+    def render(self, figure):
+        self.start()
+        renderer = self.renderers.get()
+        try:
+            fig_dict = go.Figure(expand_typed_arrays(figure)).to_dict()
+            if renderer is None:
+                return pio.to_image(fig_dict, format="png")
+            return renderer.transform(fig_dict, format="png")
+        finally:
+            self.renderers.put(renderer)
+
+    def to_png(self, figure):
+        return self.cache.get_or_compute(figure_hash(figure), lambda: self.render(figure))
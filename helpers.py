@@ -1,3 +1,4 @@
+import base64
 import numpy as np
 import pandas as pd
 import dash_bootstrap_components as dbc
@@ -7,6 +8,7 @@ from dash import html
 import plotly.graph_objects as go
 from plotly.colors import n_colors
 from dash import dash_table
+from table_query import table_columns, table_page
 
 # Colors (gradient generated between FCD "blue" #39499B and "orange" #F47B29)
 # color_gradients = ["#39499b", "#57489d", "#70469d", "#86449c", "#9b4197", "#ae3e92", "#bf3b8a", "#ce3b81",
@@ -80,8 +82,9 @@ def tab_creator(label_name, content):
     return tab
 
 
-def checklist_creator(df, column, _id):
-    unique_values = sorted(df[column].dropna().unique())
+def checklist_creator(df, column, _id, values=None):
+    # values: precomputed options (see artifacts.py), otherwise taken from the column
+    unique_values = values if values is not None else sorted(df[column].dropna().unique())
     checklist = dbc.Checklist(id=_id,
                               options=[{"label": i, 'value': i} for i in unique_values],
                               value=[],
@@ -112,22 +115,92 @@ def check_all_creator(_id):
 #     return fig
 
 
-def bar_chart_creator(df, names):
-    header = "<b>Biomasa por " + names.lower() + "</b><br>"
-    description = "<i>Total de biomasa estimada por 250 metros cuadrados</i>"
-    fig = px.bar(df, x="Biomass.250m2", y=names, color="Biomass.250m2")
+def top_n_positions(values, n):
+    # Positions of the n largest values (in no particular order), found with a partial sort
+    values = np.nan_to_num(np.asarray(values, dtype=float), nan=-np.inf)
+    if len(values) <= n:
+        return np.arange(len(values))
+    return np.argpartition(values, len(values) - n)[len(values) - n:]
+
+
+def trim_top_n(df, names, n, values="Biomass.250m2", other_label="Otros"):
+    # Keeps the n rows with the largest values (in their order) and folds the rest into one "Otros" row,
+    # placed first so it ends up at the bottom of the horizontal bar chart (other_label=None drops them)
+    if n is None or len(df) <= n + 1:
+        return df
+    keep = np.zeros(len(df), dtype=bool)
+    keep[top_n_positions(df[values].to_numpy(), n)] = True
+    if other_label is None:
+        return df[keep]
+    others = pd.DataFrame({names: [other_label], values: [round(df.loc[~keep, values].sum(), 2)]})
+    return pd.concat([others, df[keep]], ignore_index=True)
+
+
+def typed_array(values):
+    # Numeric arrays as plotly.js typed arrays (base64 of float64/int32 values) instead of JSON number lists.
+    # Floats keep 64 bits: biomass totals have more significant digits than float32 holds
+    array = np.asarray(values)
+    if array.dtype.kind == "f":
+        dtype = "f8"
+    elif array.dtype.kind in "iu":
+        dtype = "i4"
+    else:
+        return values
+    return {"dtype": dtype, "bdata": base64.b64encode(array.astype("<" + dtype).tobytes()).decode("ascii")}
+
+
+def compact_figure(fig):
+    # Figure dict with the numeric data arrays of the traces encoded as typed arrays
+    fig_dict = fig.to_plotly_json()
+    for trace in fig_dict["data"]:
+        for key in ("x", "y"):
+            if key in trace and trace[key] is not None:
+                trace[key] = typed_array(trace[key])
+        marker = trace.get("marker")
+        if marker and not isinstance(marker.get("color", ""), str):
+            marker["color"] = typed_array(marker["color"])
+    return fig_dict
+
+
+def expand_typed_arrays(value):
+    # Inverse of compact_figure, for code that validates figures with plotly.py (e.g. the image export)
+    if isinstance(value, dict):
+        if set(value) == {"dtype", "bdata"}:
+            return np.frombuffer(base64.b64decode(value["bdata"]), dtype="<" + value["dtype"]).tolist()
+        return {key: expand_typed_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [expand_typed_arrays(item) for item in value]
+    return value
+
+
+def bar_chart_creator(df, names, top_n=None, values="Biomass.250m2", label="Biomasa",
+                      description="Total de biomasa estimada por 250 metros cuadrados", other_label="Otros",
+                      errors=None):
+    # errors: columns of df with the lower and upper bounds of the values, drawn as error bars
+    df = trim_top_n(df, names, top_n, values, other_label)
+    header = "<b>" + label + " por " + names.lower() + "</b><br>"
+    description = "<i>" + description + "</i>"
+    fig = px.bar(df, x=values, y=names, color=values)
+    if errors is not None:
+        lower, upper = errors
+        fig.update_traces(error_x=dict(type="data", symmetric=False, color="#333f54",
+                                       array=(df[upper] - df[values]).to_numpy(),
+                                       arrayminus=(df[values] - df[lower]).to_numpy()))
     fig.update_layout(title=(header + description),
                       title_font_family="Roboto",
                       title_font_color="#333f54")
     return fig
 
 
-def bivariate_bar_chart_creator(df, names_x, names_y):
-    header = "<b>Biomasa por " + names_x.lower() + " y por " + names_y.lower() + "</b><br>"
-    description = "<i>Total de biomasa estimada por 250 metros cuadrados</i>"
+def bivariate_bar_chart_creator(df, names_x, names_y, label="Biomasa",
+                                description="Total de biomasa estimada por 250 metros cuadrados",
+                                value_label="Biomasa por 250 m2"):
+    # df: crosstab already trimmed to the rows and columns shown (see pivot.SparsePivot.trim)
+    header = "<b>" + label + " por " + names_x.lower() + " y por " + names_y.lower() + "</b><br>"
+    description = "<i>" + description + "</i>"
     fig = px.bar(df, x=names_x, y=df.columns[1:],
                  color_discrete_sequence=color_gradients,
-                 labels={"value": "Biomasa por 250 m2",
+                 labels={"value": value_label,
                          "variable": names_y})
     fig.update_layout(title=(header + description),
                       title_font_family="Roboto",
@@ -156,16 +229,17 @@ def value_cards(label, values):
     card = html.Div(
         [
             html.Div(label, className="value-cards-label"),
-            html.Div(len(values), className="value-cards-value")
+            html.Div(values if isinstance(values, int) else len(values), className="value-cards-value")
         ], className="value-cards"
     )
     return card
 
 
 def two_axis_line_chart(df, x_column, y1_value_to_count, y2_value_to_count, x_name, y1_name, y2_name):
-    x = df[x_column].unique()
-    y1 = df.groupby([x_column])[y1_value_to_count].count()
-    y2 = df.groupby([x_column])[y2_value_to_count].nunique()
+    # Both counts in one group by pass (x values in the same sorted order as the counts)
+    counts = df.groupby(x_column, observed=True).agg(y1=(y1_value_to_count, "count"),
+                                                     y2=(y2_value_to_count, "nunique"))
+    x, y1, y2 = counts.index, counts["y1"], counts["y2"]
 
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     fig.add_trace(
@@ -195,7 +269,7 @@ def two_axis_line_chart(df, x_column, y1_value_to_count, y2_value_to_count, x_na
 
 
 def simple_map(df, lat, long, dimension, value_to_count):
-    df = pd.DataFrame(df.groupby([dimension, lat, long])[value_to_count].count())
+    df = pd.DataFrame(df.groupby([dimension, lat, long], observed=True)[value_to_count].count())
     df.reset_index(col_level=0, inplace=True)
     df.rename(columns={'id': 'Registros'}, inplace=True)
 
@@ -222,6 +296,20 @@ def simple_map(df, lat, long, dimension, value_to_count):
     return fig
 
 
+def biomass_map(lat, long, biomass, records, center, zoom, height=600):
+    # One marker per grid cell of the spatial index: area proportional to biomass, colour by biomass
+    size = np.sqrt(biomass / biomass.max()) * 40 + 6 if len(biomass) else biomass
+    text = ["Biomasa: {:,.2f}<br>Registros: {:,.0f}".format(b, r) for b, r in zip(biomass, records)]
+    fig = go.Figure(go.Scattermapbox(lat=lat, lon=long, text=text, hoverinfo="text",
+                                     marker=dict(size=size, color=biomass, colorscale="YlOrRd", showscale=True,
+                                                 colorbar=dict(title="Biomasa"), sizemode="diameter")))
+    # uirevision keeps the user's pan and zoom when the filters change the markers
+    fig.update_layout(mapbox_style="carto-positron", mapbox_center=center, mapbox_zoom=zoom, height=height,
+                      margin=dict(l=0, r=0, t=40, b=0), uirevision="biomass-map",
+                      title="<b>Biomasa por área</b>", title_font_family="Roboto", title_font_color="#333f54")
+    return fig
+
+
 # Deprecated table function. Plotly renders wrong some values in table.
 # def create_one_variable_table(df, names):
 #     header = "<b>Biomasa por " + names.lower() + "</b><br>"
@@ -251,34 +339,50 @@ def simple_map(df, lat, long, dimension, value_to_count):
 #
 #     return fig
 
-def create_one_variable_table(df, names):
-    header = "Biomasa por " + names.lower()
-    description = "Total de biomasa estimada por 250 metros cuadrados"
+def paged_data_table(df, page_size):
+    # Paging, sorting and filtering are done on the server (see table_query), only the first page is sent here
+    data, page_count = table_page(df, 0, page_size)
+    table = dash_table.DataTable(
+        id="table-data",
+        columns=table_columns(df),
+        data=data,
+        page_action="custom",
+        page_current=0,
+        page_size=page_size,
+        page_count=page_count,
+        sort_action="custom",
+        sort_mode="multi",
+        sort_by=[],
+        filter_action="custom",
+        filter_query="",
+        style_table={'overflowX': 'auto'},
+        style_header={
+            "backgroundColor": "#333f54",
+            "fontWeight": "bold",
+            "color": "white",
+        },
+        style_cell={'textAlign': 'center',
+                    'font-family': 'sans-serif',
+                    'fontSize': 12},
+        style_data_conditional=[
+            {
+                "if": {"state": "selected"},
+                "backgroundColor": "rgba(0, 116, 217, 0.3)",
+                "border": "1px solid #333f54",
+            }
+        ]
+    )
+    return table
+
+
+def create_one_variable_table(df, names, page_size=25, label="Biomasa",
+                              description="Total de biomasa estimada por 250 metros cuadrados"):
+    header = label + " por " + names.lower()
     table = html.Div(
         [
             html.Label(header, className="labels"),
             html.P(description, style={"fontStyle": "italic"}),
-            dash_table.DataTable(
-                id='table',
-                columns=[{"name": i, "id": i} for i in df.columns],
-                data=df.to_dict('records'),
-                style_table={'overflowX': 'auto'},
-                style_header={
-                    "backgroundColor": "#333f54",
-                    "fontWeight": "bold",
-                    "color": "white",
-                },
-                style_cell={'textAlign': 'center',
-                            'font-family': 'sans-serif',
-                            'fontSize': 12},
-                style_data_conditional=[
-                    {
-                        "if": {"state": "selected"},
-                        "backgroundColor": "rgba(0, 116, 217, 0.3)",
-                        "border": "1px solid #333f54",
-                    }
-                ]
-            )
+            paged_data_table(df, page_size)
         ], style={"padding": "20px"}
     )
 
@@ -313,34 +417,14 @@ def create_one_variable_table(df, names):
 #     return fig
 
 
-def create_two_variable_table(df, names_a, names_b):
-    header = "Biomasa por " + names_a.lower() + " y por " + names_b.lower()
-    description = "Total de biomasa estimada por 250 metros cuadrados"
+def create_two_variable_table(df, names_a, names_b, page_size=25, label="Biomasa",
+                              description="Total de biomasa estimada por 250 metros cuadrados"):
+    header = label + " por " + names_a.lower() + " y por " + names_b.lower()
     table = html.Div(
         [
             html.Label(header, className="labels"),
             html.P(description, style={"fontStyle": "italic"}),
-            dash_table.DataTable(
-                id='table',
-                columns=[{"name": i, "id": i} for i in df.columns],
-                data=df.to_dict('records'),
-                style_table={'overflowX': 'auto'},
-                style_header={
-                    "backgroundColor": "#333f54",
-                    "fontWeight": "bold",
-                    "color": "white",
-                },
-                style_cell={'textAlign': 'center',
-                            'font-family': 'sans-serif',
-                            'fontSize': 12},
-                style_data_conditional=[
-                    {
-                        "if": {"state": "selected"},
-                        "backgroundColor": "rgba(0, 116, 217, 0.3)",
-                        "border": "1px solid #333f54",
-                    }
-                ]
-            )
+            paged_data_table(df, page_size)
         ], style={"padding": "20px"}
     )
 
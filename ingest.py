@@ -0,0 +1,138 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import config
+from data_index import PARTITION_COLUMN, PartitionOffsets
+from loader import downcast, memory_footprint, write_partitioned
+
+# Columns that must be numbers (the rest of config.DATA_COLUMNS are categories, except the record id)
+NUMERIC_COLUMNS = ["Latitude", "Longitude", "year", "Biomass.250m2"]
+# Rows are stored in this order: the year first, so every year is a contiguous block (see data_index.py)
+SORT_COLUMNS = [PARTITION_COLUMN, "Bioregion", "Subzone.name", "Island", "Site", "epoca"]
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def read_export(path):
+    # Raw monitoring export: CSV or Excel (Excel needs openpyxl)
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        return pd.read_excel(path)
+    if extension == ".csv":
+        return pd.read_csv(path, low_memory=False)
+    if extension == ".feather":
+        return pd.read_feather(path)
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    raise SchemaError("Unsupported file type: {}".format(path))
+
+
+def validate(df, columns=None):
+    # Checks the columns the app reads and converts the numeric ones; returns the frame and the problems found
+    columns = columns or config.DATA_COLUMNS
+    missing = [column for column in columns if column not in df]
+    if missing:
+        raise SchemaError("Missing columns: {}".format(", ".join(missing)))
+    problems = []
+    for column in NUMERIC_COLUMNS:
+        values = pd.to_numeric(df[column], errors="coerce")
+        invalid = int((values.isna() & df[column].notna()).sum())
+        if invalid:
+            problems.append("{}: {} values that are not numbers".format(column, invalid))
+        df[column] = values
+    missing_years = int(df[PARTITION_COLUMN].isna().sum())
+    if missing_years:
+        problems.append("{}: {} rows without year were dropped".format(PARTITION_COLUMN, missing_years))
+        df = df[df[PARTITION_COLUMN].notna()]
+    df = df.astype({PARTITION_COLUMN: "int64"})
+    return df[columns], problems
+
+
+def spelling_key(values):
+    # Same key for spellings that only differ in case, accents or spaces
+    return (values.str.normalize("NFKD").str.encode("ascii", errors="ignore").str.decode("ascii")
+            .str.casefold().str.replace(r"\s+", " ", regex=True).str.strip())
+
+
+def normalize_categories(series):
+    # Trimmed text, one spelling (the most frequent one) per spelling key, as a categorical; and the values changed
+    values = series.astype("string").str.normalize("NFC").str.replace(r"\s+", " ", regex=True).str.strip()
+    values = values.mask(values == "")
+    counts = values.value_counts()
+    spellings = pd.Series(counts.index, index=counts.index)
+    canonical = spellings.groupby(spelling_key(spellings).to_numpy(), sort=False).transform("first")
+    normalized = values.map(canonical).astype("category")
+    # Blank values that are now missing count as changed too
+    original = series.astype("string")
+    changed = int((normalized.astype("string") != original).fillna(normalized.isna() != original.isna()).sum())
+    return normalized, changed
+
+
+def compact(df):
+    # Normalized categories, biomass rounded to the 2 decimals shown in the app, narrow dtypes, sorted rows
+    changes = {}
+    for column in df.columns:
+        if column in NUMERIC_COLUMNS or not (df[column].dtype == object or pd.api.types.is_string_dtype(df[column])):
+            continue
+        df[column], changed = normalize_categories(df[column])
+        if changed:
+            changes[column] = changed
+    df["Biomass.250m2"] = df["Biomass.250m2"].round(2)
+    df = downcast(df)
+    sort_columns = [column for column in SORT_COLUMNS if column in df]
+    df = df.sort_values(sort_columns, kind="stable", ignore_index=True)
+    return df, changes
+
+
+def write_parquet(df, path, column=PARTITION_COLUMN):
+    # One row group per year, with min/max statistics so readers can skip the years they do not need
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+    offsets = PartitionOffsets(df[column]).offsets
+    with pq.ParquetWriter(path, table.schema, compression="zstd", write_statistics=True) as writer:
+        for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            writer.write_table(table.slice(start, stop - start))
+
+
+def ingest(inputs, output, base=None):
+    frames = [read_export(path) for path in inputs]
+    if base:
+        # Previous dataset: new survey seasons are added to it
+        frames.insert(0, read_export(base))
+    raw = pd.concat(frames, ignore_index=True)
+    raw_memory = memory_footprint(raw)
+
+    df, problems = validate(raw)
+    df, changes = compact(df)
+    if output.endswith(".parquet"):
+        write_parquet(df, output)
+    else:
+        write_partitioned(df, output)
+
+    report = ["Rows: {} read, {} written".format(len(raw), len(df)),
+              "Years: {}-{}".format(df[PARTITION_COLUMN].min(), df[PARTITION_COLUMN].max()),
+              "Memory: {:.1f} MB raw, {:.1f} MB compacted".format(raw_memory / 2 ** 20, memory_footprint(df) / 2 ** 20),
+              "File: {} ({:.1f} MB)".format(output, os.path.getsize(output) / 2 ** 20)]
+    report += ["Spellings unified in {}: {} values".format(column, count) for column, count in changes.items()]
+    report += ["Warning: " + problem for problem in problems]
+    return df, report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the app dataset from raw monitoring exports (CSV or Excel)")
+    parser.add_argument("inputs", nargs="+", help="exported survey files")
+    parser.add_argument("--output", default=config.DATA_PATH, help="dataset to write (.feather or .parquet)")
+    parser.add_argument("--base", help="existing .feather or .parquet dataset the exports are added to")
+    args = parser.parse_args()
+    try:
+        _, report = ingest(args.inputs, args.output, args.base)
+    except SchemaError as error:
+        print("Error:", error)
+        sys.exit(1)
+    print("\n".join(report))
@@ -0,0 +1,106 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import config
+from data_index import PARTITION_COLUMN, PartitionOffsets, prepare_data, sort_partitions
+
+logger = logging.getLogger(__name__)
+
+
+def is_parquet(path):
+    # Datasets written by `python ingest.py --output *.parquet`; any other file is read as Feather
+    return path.lower().endswith(".parquet")
+
+
+def read_table(path, columns):
+    # Memory-mapped read of only the requested columns (missing ones are skipped). Parquet files are compressed:
+    # they are read into memory instead.
+    if is_parquet(path):
+        schema = pq.read_schema(path)
+        return pq.read_table(path, columns=[column for column in columns if column in schema.names])
+    schema = pa.ipc.open_file(pa.memory_map(path, "r")).schema
+    columns = [column for column in columns if column in schema.names]
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def read_partitions(path, columns, low, high, column=PARTITION_COLUMN):
+    # Memory-mapped read of the rows with low <= column <= high. Record batches whose values of the column are
+    # all outside the range are skipped without reading their other columns (in Parquet files, the row groups
+    # outside the range, from their statistics).
+    if is_parquet(path):
+        names = pq.read_schema(path).names
+        return pq.read_table(path, columns=[name for name in columns if name in names],
+                             filters=[(column, ">=", low), (column, "<=", high)])
+    reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+    columns = [name for name in columns if name in reader.schema.names]
+    batches = []
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        values = batch.column(column)
+        if len(values) and pc.max(values).as_py() >= low and pc.min(values).as_py() <= high:
+            batches.append(batch.select(columns))
+    table = pa.Table.from_batches(batches) if batches else reader.schema.empty_table().select(columns)
+    values = table[column]
+    return table.filter(pc.and_(pc.greater_equal(values, low), pc.less_equal(values, high)))
+
+
+def write_partitioned(df, path, column=PARTITION_COLUMN):
+    # Feather file sorted by column with one record batch per value, so read_partitions only touches the
+    # batches of the requested range (uncompressed: the batches are read in place from the memory map)
+    df = sort_partitions(df, column)
+    table = pa.Table.from_pandas(df, preserve_index=False).combine_chunks()
+    offsets = PartitionOffsets(df[column]).offsets
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            writer.write_table(table.slice(start, stop - start))
+
+
+def encode_strings(table):
+    # Text columns become dictionary arrays, which pandas reads as categoricals
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.dictionary_encode(table[field.name]))
+    return table
+
+
+def downcast(df, downcast_floats=True):
+    # Biomass is rounded to 2 decimals when the dataset is built (see ingest.py), not here
+    for column in df.select_dtypes("integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    if downcast_floats:
+        for column in df.select_dtypes("float64").columns:
+            values = df[column].to_numpy()
+            narrow = values.astype(np.float32)
+            # Only when the 2 decimals shown in the app survive the conversion
+            if np.allclose(narrow, values, rtol=0, atol=0.005, equal_nan=True):
+                df[column] = narrow
+    return df
+
+
+def memory_footprint(df):
+    return df.memory_usage(deep=True).sum()
+
+
+def load_dataset(path=None, columns=None, downcast_floats=None, years=None):
+    # years: (first, last) to load only those years (all of them when None)
+    path = path or config.DATA_PATH
+    columns = columns or config.DATA_COLUMNS
+    downcast_floats = config.DOWNCAST_FLOATS if downcast_floats is None else downcast_floats
+    years = config.YEARS if years is None else years
+
+    table = read_partitions(path, columns, *years) if years else read_table(path, columns)
+    table = encode_strings(table)
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    # Sorted by year: the year filter is then a slice of rows (see data_index.PartitionOffsets)
+    df = sort_partitions(prepare_data(downcast(df, downcast_floats)))
+
+    logger.info("Loaded %s: %d rows, %d columns, %.1f MB in memory", path, len(df), len(df.columns),
+                memory_footprint(df) / 2 ** 20)
+    return df
@@ -1,28 +1,88 @@
 import os
+import time
+import atexit
+import uuid
+import logging
 import pandas as pd
-import numpy as np
 import dash
-from dash import dcc, html, Input, Output, State
-import plotly.graph_objects as go
+import flask
+from urllib.parse import urlencode
+from dash import dcc, html, Input, Output, State, ClientsideFunction
 import dash_bootstrap_components as dbc
 from helpers import *
+import config
+from data_index import FILTER_COLUMNS, selection_mask
+from cache import decode_state, encode_state, filter_state_key
+from pivot import SparsePivot
+from measures import MEASURES, metric_intervals, metric_values
+from export import ImageExporter, chart_file_name
+from streaming import FORMATS, stream_frame
+from table_query import table_page
+from api import API_FORMATS, conditional_response, encode_view, request_state, tidy_table
+from artifacts import dataset_fingerprint
+from bootstrap import start_pool
+from datasets import DatasetRegistry
+from spatial import viewport
+from warmup import warm_up
+import metrics
+from metrics import count, instrumented, phase
 
-# TODO Dynamic filters
 # TODO Change column names
 # TODO Add chart labels (bar values)
 # TODO Add tables section
 # TODO Second metric CSS Show it lighter
-# TODO If metric has >20 values, trim top for chart & Choose pie chart for 2 values
+# TODO Choose pie chart for 2 values
 # TODO Add logo in export images
-# TODO add button to invert order in charts
-# TODO Delete downloaded file
 
-# Data loading
-data = pd.read_feather(r"C:\Users\juancarlos.izurieta\PycharmProjects\KnowingMoreMarine\data\fish.feather")
-data["Biomass.250m2"] = round(data["Biomass.250m2"], 2)
+logging.basicConfig(level=logging.INFO)
+# Bootstrap workers, forked first: the app has no threads yet and holds no data
+start_pool()
+
+# Survey datasets (paths and columns in config.py), each loaded with its cube, indexes and caches the first time
+# it is used, within the memory budget. With FISH_SHARED_MEMORY set, the first one is attached from the shared
+# memory published by `python shared.py`, instead of every worker loading its own copy.
+datasets = DatasetRegistry(config.DATASETS, config.DATASETS_MEMORY_MB * 2 ** 20,
+                           shared_memory={config.DEFAULT_DATASET: config.SHARED_MEMORY_NAME})
+atexit.register(datasets.save_state_logs)
+# The page opens on the first dataset: its options fill the controls (switch_dataset changes them for the others).
+# Only these plain values are kept, not the dataset, so that it can be unloaded like the others.
+artifacts = datasets.get(config.DEFAULT_DATASET).artifacts
+variable_columns = list(datasets.get(config.DEFAULT_DATASET).variable_columns)
+
+
+def default_state(artifacts):
+    # Filters of a page load, for the page itself, switch_dataset and the warm-up: every value of the checklists,
+    # every season and every year
+    return [[artifacts["checklists"][column] for column in FILTER_COLUMNS[:5]], artifacts["seasons"],
+            [artifacts["years"][0], artifacts["years"][-1]]]
+
+
+map_zoom = 7
+# Columns of the confidence interval bounds in the one-variable table
+INTERVAL_COLUMNS = ["IC 95% inferior", "IC 95% superior"]
+
+# PNG export of the charts, rendered in memory by kaleido processes started in the background
+image_exporter = ImageExporter(renderers=config.EXPORT_RENDERERS, cache_size=config.EXPORT_CACHE_SIZE)
+image_exporter.start_in_background()
+
+# Background jobs for the charts (FISH_BACKGROUND_CALLBACKS=1): results are kept in a disk cache shared by the
+# processes, by callback arguments and dataset versions, so a repeated view is answered from there
+background_manager = None
+if config.BACKGROUND_CALLBACKS:
+    try:
+        import diskcache
+        datasets_version = {name: dataset_fingerprint(path) for name, path in config.DATASETS.items()}
+        background_manager = dash.DiskcacheManager(diskcache.Cache(config.BACKGROUND_CACHE_DIR),
+                                                   cache_by=[lambda: sorted(datasets_version.items())])
+    except ImportError:
+        logging.warning("dash[diskcache] is not installed: the charts are computed in the request")
 
 # App constructor
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
+# (the table is created by a callback, so its own callbacks are registered before it exists in the layout)
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY], suppress_callback_exceptions=True,
+                background_callback_manager=background_manager)
+# Callback timings and counters, served in Prometheus format on /metrics
+metrics.init_app(app.server)
 
 # Methods
 methods = html.Div(
@@ -34,11 +94,8 @@ methods = html.Div(
     ]
 )
 
-records_label = value_cards("Registros", data)
-sites_label = value_cards("Sitios", data["Site"].unique())
-islands_label = value_cards("Islas", data["Island"].unique())
-species_label = value_cards("Especies", data["ScientificName"].unique())
-func_groups_label = value_cards("Grupos funcionales", data["Functional.Group"].unique())
+records_label, sites_label, islands_label, species_label, func_groups_label = [
+    value_cards(label, count) for label, count in artifacts["value_cards"]]
 
 methods_value_cards = html.Div(
     [
@@ -47,11 +104,11 @@ methods_value_cards = html.Div(
         islands_label,
         species_label,
         func_groups_label
-    ], className="value-cards-container"
+    ], className="value-cards-container", id="methods-value-cards"
 )
 
-methods_line_chart = two_axis_line_chart(data, "year", "id", "Site", "Años", "Registros", "Sitios")
-methods_map = simple_map(data, "Latitude", "Longitude", "Site", "id")
+methods_line_chart = artifacts["line_chart"]
+methods_map = artifacts["map"]
 
 methods_charts = html.Div(
     [
@@ -67,26 +124,40 @@ methods_charts = html.Div(
 )
 
 # Controls
-bioregion_selection = checklist_creator(data, "Bioregion", _id="bioregion-selection")
-zone_selection = checklist_creator(data, "Subzone.name", _id="zone-selection")
-island_selection = checklist_creator(data, "Island", _id="island-selection")
-order_selection = checklist_creator(data, "ORDER", _id="order-selection")
-family_selection = checklist_creator(data, "Family", _id="family-selection")
-functional_group_selection = checklist_creator(data, "Functional.Group", _id="functional-group-selection")
+dataset_selection = dcc.Dropdown(id="dataset",
+                                 options=[{"label": config.DATASET_LABELS.get(name, name), "value": name}
+                                          for name in config.DATASETS],
+                                 value=config.DEFAULT_DATASET, clearable=False)
+bioregion_selection = checklist_creator(None, "Bioregion", _id="bioregion-selection",
+                                         values=artifacts["checklists"]["Bioregion"])
+zone_selection = checklist_creator(None, "Subzone.name", _id="zone-selection",
+                                    values=artifacts["checklists"]["Subzone.name"])
+island_selection = checklist_creator(None, "Island", _id="island-selection",
+                                      values=artifacts["checklists"]["Island"])
+order_selection = checklist_creator(None, "ORDER", _id="order-selection",
+                                     values=artifacts["checklists"]["ORDER"])
+family_selection = checklist_creator(None, "Family", _id="family-selection",
+                                      values=artifacts["checklists"]["Family"])
+functional_group_selection = checklist_creator(None, "Functional.Group",
+                                                _id="functional-group-selection",
+                                                values=artifacts["checklists"]["Functional.Group"])
 season_selection = dbc.Checklist(id="season-selection",
-                                 options=[{"label": i, 'value': i} for i in data["epoca"].dropna().unique()],
-                                 value=["Fría", "Caliente"],
+                                 options=[{"label": i, 'value': i} for i in artifacts["seasons"]],
+                                 value=default_state(artifacts)[1],
                                  switch=True)
-years = data["year"].dropna().unique()
+years = artifacts["years"]
 year_selection = dcc.RangeSlider(id="year-selection",
                                  min=years[0],
                                  max=years[-1],
-                                 value=[years[0], years[-1]],
+                                 value=default_state(artifacts)[2],
                                  tooltip={"placement": "bottom", "always_visible": True})
 
 # Controls layout (accordions panel)
 controls = html.Div(
     [
+        # Only shown when there are several datasets
+        html.Div([html.Label("Conjunto de datos", className="labels"), dataset_selection, html.Br()],
+                 style={"display": "none"} if len(config.DATASETS) == 1 else {}),
         html.Label("Filtros y controles", className="labels"),
         html.Br(),
         html.Br(),
@@ -158,7 +229,7 @@ controls = html.Div(
 
 # Chart variable picker controls
 variable_one = dcc.Dropdown(id="variable-one",
-                            options=[{"label": i, 'value': i} for i in data.select_dtypes([object]).columns],
+                            options=[{"label": i, 'value': i} for i in variable_columns],
                             placeholder="Seleccione una variable",
                             value="Bioregion", clearable=False)
 
@@ -168,23 +239,42 @@ add_second_variable = dbc.Checklist(id="add-second-variable",
                                     switch=True)
 
 variable_two = html.Div(dcc.Dropdown(id="variable-two",
-                                     options=[{"label": i, 'value': i} for i in
-                                              data.select_dtypes([object]).columns],
+                                     options=[{"label": i, 'value': i} for i in variable_columns],
                                      placeholder="Seleccione una variable",
                                      value="Functional.Group", disabled=True, clearable=False))
 
+metric = dcc.Dropdown(id="metric",
+                      options=[{"label": measure["label"], "value": name} for name, measure in MEASURES.items()],
+                      value="sum", clearable=False)
+
+uncertainty = dbc.Checklist(id="uncertainty",
+                            options=[{"label": "Intervalos de confianza (95%)", "value": True}],
+                            value=[],
+                            switch=True)
+
+invert_order = dbc.Checklist(id="invert-order",
+                             options=[{"label": "Invertir orden", "value": True}],
+                             value=[],
+                             switch=True)
+
 chart_controls = html.Div(
     children=[
+        html.Label("Indicador", className="labels"),
+        metric,
         html.Label("Métrica", className="labels"),
         variable_one,
         add_second_variable,
-        variable_two
+        variable_two,
+        uncertainty,
+        invert_order
     ]
 )
 
 # Chart section
 charts = html.Div(
     children=[
+        # Chart as built by the server; the one displayed may have its order inverted in the browser
+        dcc.Store(id="chart-figure"),
         dcc.Graph("chart", config={'displayModeBar': False}),
         html.Button("Descargar imagen", id="btn-image", className="download-button"),
         dcc.Download(id="download-image")
@@ -195,8 +285,20 @@ charts = html.Div(
 tables = html.Div(
     children=[
         html.Div(id="table"),
-        html.Button("Descargar tabla", id="btn-table", className="download-button"),
-        dcc.Download(id="download-table")
+        dbc.RadioItems(id="table-scope",
+                       options=[{"label": "Tabla", "value": "table"},
+                                {"label": "Registros filtrados", "value": "raw"}],
+                       value="table",
+                       inline=True),
+        dbc.RadioItems(id="table-format",
+                       options=[{"label": "CSV", "value": "csv"},
+                                {"label": "Parquet", "value": "parquet"},
+                                {"label": "Feather", "value": "feather"}],
+                       value="csv",
+                       inline=True),
+        # Plain link: the file is streamed by the /download/table route, not sent through a callback
+        html.A(html.Button("Descargar tabla", id="btn-table", className="download-button"),
+               id="download-table", href="", download="")
     ]
 )
 
@@ -238,44 +340,59 @@ table_tab_sections = html.Div(
     )
 )
 
+# Map tab: biomass by grid cell, for the filters of the charts tab and the area in view
+map_section = html.Div(
+    [
+        html.Label("Biomasa con los filtros de la pestaña de gráficos", className="labels"),
+        dcc.Graph(id="biomass-map", config={'displayModeBar': False})
+    ], style={"marginTop": "20px"}
+)
+
 # Tabs
 tab1 = tab_creator("MÉTODOS", [methods, methods_value_cards, methods_charts])
 tab2 = tab_creator("GRÁFICOS", chart_tab_sections)
 tab3 = tab_creator("TABLAS", "CAMBIAR A DATOS?")
-tab4 = tab_creator("MAPAS", "PENDIENTE")
+tab4 = tab_creator("MAPAS", map_section)
 tab5 = tab_creator("DESCARGAS", "DESCARGAS")
 
 tabs = dbc.Tabs([tab1, tab2, tab3, tab4])
 
-# App layout
-app.layout = html.Div(
-    [
-        header,
-        tabs,
-        html.Hr(),
-        footer
-    ], style={"width": "99%"}  # This avoids the horizontal scroll bar
-)
+# App layout (served on every page load so each browser session gets its own id)
+def serve_layout():
+    return html.Div(
+        [
+            dcc.Store(id="session-id", data=str(uuid.uuid4())),
+            header,
+            tabs,
+            html.Hr(),
+            footer
+        ], style={"width": "99%"}  # This avoids the horizontal scroll bar
+    )
+
+
+app.layout = serve_layout
 
 
 # Callbacks
 @app.callback(
     Output("download-image", "data"),
     Input("btn-image", "n_clicks"),
-    Input("chart", "figure")
+    State("chart", "figure"),
+    prevent_initial_call=True
 )
+@instrumented("func")
 def func(n_clicks, chart_dict):
-    file_name = chart_dict["layout"]["title"]["text"]
-    idx1 = file_name.index("<b>")
-    idx2 = file_name.index("</b>")
-    file_name = file_name[idx1 + len("<b>"): idx2] + ".png"
-    if n_clicks:
-        fig = go.Figure(chart_dict)
-        fig.write_image(file_name)
-        return dcc.send_file(file_name)
+    if not n_clicks or not chart_dict:
+        raise dash.exceptions.PreventUpdate
+    with phase("render"):
+        png = image_exporter.to_png(chart_dict)
+    return dcc.send_bytes(png, chart_file_name(chart_dict))
 
 
-@app.callback(
+# Select all and the second variable switch only change the controls: they run in the browser
+# (assets/clientside.js) instead of making a request each
+app.clientside_callback(
+    ClientsideFunction(namespace="explorer", function_name="select_all"),
     Output("bioregion-selection", "value"),
     Output("zone-selection", "value"),
     Output("island-selection", "value"),
@@ -292,33 +409,144 @@ def func(n_clicks, chart_dict):
     State("order-selection", "options"),
     State("family-selection", "options")
 )
-def select_all(checkA, checkB, checkC, checkD, checkE, bioregion_options, zone_options, island_options, order_options,
-               family_options):
-    bioregion_all = [i["value"] for i in bioregion_options if checkA]
-    zone_all = [i["value"] for i in zone_options if checkB]
-    island_all = [i["value"] for i in island_options if checkC]
-    order_all = [i["value"] for i in order_options if checkD]
-    family_all = [i["value"] for i in family_options if checkE]
 
-    return bioregion_all, zone_all, island_all, order_all, family_all
+app.clientside_callback(
+    ClientsideFunction(namespace="explorer", function_name="toggle_second_variable"),
+    Output("variable-two", "disabled"),
+    Input("add-second-variable", "value")
+)
+
+app.clientside_callback(
+    ClientsideFunction(namespace="explorer", function_name="invert_chart"),
+    Output("chart", "figure"),
+    Input("chart-figure", "data"),
+    Input("invert-order", "value")
+)
 
 
 @app.callback(
-    Output("variable-two", "disabled"),
+    Output("chart-figure", "data"),
+    Output("table", "children"),
+    Input("dataset", "value"),
+    Input("variable-one", "value"),
     Input("add-second-variable", "value"),
-    State("variable-two", "disabled")
+    Input("variable-two", "value"),
+    Input("bioregion-selection", "value"),
+    Input("zone-selection", "value"),
+    Input("island-selection", "value"),
+    Input("order-selection", "value"),
+    Input("family-selection", "value"),
+    Input("season-selection", "value"),
+    Input("year-selection", "value"),
+    Input("metric", "value"),
+    Input("uncertainty", "value"),
+    State("session-id", "data"),
+    background=background_manager is not None,
+    # Poll for the result of the job every 250 ms; the session id (last argument) does not change the result
+    interval=250,
+    cache_args_to_ignore=[13]
 )
-def generate_second_variable_input(check, status):
-    if check:
-        status = False
-    else:
-        status = True
-    return status
+@instrumented("generate_figures")
+def generate_figures(dataset_name, variable_one, check, variable_two, selectionA, selectionB, selectionC, selectionD,
+                     selectionE, selectionF, selectionG, metric, uncertainty, session_id):
+    if variable_two is None:
+        # PreventUpdate prevents ALL outputs updating
+        raise dash.exceptions.PreventUpdate
+
+    key = filter_state_key(variable_one, check, variable_two,
+                           [selectionA, selectionB, selectionC, selectionD, selectionE], selectionF, selectionG, metric,
+                           uncertainty)
+    if background_manager is not None:
+        return background_view(dataset_name, key, session_id)
+    dataset = active_dataset(dataset_name)
+    dataset.state_log.record(key)
+    view = get_view(dataset, key, session_id)
+    return view["figure"], view["table"]
+
+
+def background_view(dataset_name, key, session_id):
+    # Body of a background job, a process forked for this request: it sees the views cached before the fork, and
+    # what it computes only reaches the others through the result cache. Until the debounce delay is over, a newer
+    # request of the page stops it before any work is done.
+    time.sleep(config.BACKGROUND_DEBOUNCE)
+    dataset = active_dataset(dataset_name)
+    try:
+        dataset.state_log.record(key)
+        view = get_view(dataset, key, session_id)
+        # The table pages and downloads are served by the app processes: they read the table data from here
+        background_manager.handle.set(table_data_key(dataset_name, key), view["table_data"],
+                                      expire=background_manager.expire)
+    finally:
+        dataset.state_log.save()
+    return view["figure"], view["table"]
+
+
+def table_data_key(dataset_name, key):
+    # Key of the table data of a view in the disk cache of the background jobs
+    return "table-data", dataset_name, datasets_version[dataset_name], encode_state(key)
+
+
+def view_table_data(dataset, key, session_id):
+    # Table data of a view: the one saved by the background job that built it, when there is one, so that it is
+    # not computed again in the app process, or the one of the cached view. Otherwise it is computed without
+    # rendering the chart and the table, which the table pages, downloads and the API do not use.
+    if background_manager is not None:
+        table_data = background_manager.handle.get(table_data_key(dataset.name, key))
+        if table_data is not None:
+            count("cache_hits")
+            return table_data
+    view = dataset.figures_cache.get(key)
+    if view is not None:
+        count("cache_hits")
+        return view["table_data"]
+    count("cache_misses")
+    _, values, intervals = view_values(dataset, key, session_id)
+    return view_frames(values, key[0], key[1], key[6], intervals)[1]
 
 
 @app.callback(
-    Output("chart", "figure"),
-    Output("table", "children"),
+    Output("table-data", "data"),
+    Output("table-data", "page_count"),
+    Input("table-data", "page_current"),
+    Input("table-data", "page_size"),
+    Input("table-data", "sort_by"),
+    Input("table-data", "filter_query"),
+    State("dataset", "value"),
+    State("variable-one", "value"),
+    State("add-second-variable", "value"),
+    State("variable-two", "value"),
+    State("bioregion-selection", "value"),
+    State("zone-selection", "value"),
+    State("island-selection", "value"),
+    State("order-selection", "value"),
+    State("family-selection", "value"),
+    State("season-selection", "value"),
+    State("year-selection", "value"),
+    State("metric", "value"),
+    State("uncertainty", "value"),
+    State("session-id", "data"),
+    # The first page comes with the table (helpers.paged_data_table)
+    prevent_initial_call=True
+)
+@instrumented("update_table_page")
+def update_table_page(page_current, page_size, sort_by, filter_query, dataset_name, variable_one, check, variable_two,
+                      selectionA, selectionB, selectionC, selectionD, selectionE, selectionF, selectionG, metric,
+                      uncertainty, session_id):
+    if variable_two is None:
+        raise dash.exceptions.PreventUpdate
+
+    # Only the requested page of the (cached) table is sent to the browser
+    key = filter_state_key(variable_one, check, variable_two,
+                           [selectionA, selectionB, selectionC, selectionD, selectionE], selectionF, selectionG, metric,
+                           uncertainty)
+    table_data = view_table_data(active_dataset(dataset_name), key, session_id)
+    with phase("table_page"):
+        return table_page(table_data, page_current, page_size, sort_by, filter_query)
+
+
+@app.callback(
+    Output("download-table", "href"),
+    Input("dataset", "value"),
     Input("variable-one", "value"),
     Input("add-second-variable", "value"),
     Input("variable-two", "value"),
@@ -328,50 +556,302 @@ def generate_second_variable_input(check, status):
     Input("order-selection", "value"),
     Input("family-selection", "value"),
     Input("season-selection", "value"),
+    Input("year-selection", "value"),
+    Input("metric", "value"),
+    Input("uncertainty", "value"),
+    Input("table-format", "value"),
+    Input("table-scope", "value")
+)
+@instrumented("update_table_download_link")
+def update_table_download_link(dataset_name, variable_one, check, variable_two, selectionA, selectionB, selectionC,
+                               selectionD, selectionE, selectionF, selectionG, metric, uncertainty, file_format, scope):
+    key = filter_state_key(variable_one, check, variable_two,
+                           [selectionA, selectionB, selectionC, selectionD, selectionE], selectionF, selectionG, metric,
+                           uncertainty)
+    query = urlencode({"dataset": dataset_name, "state": encode_state(key), "format": file_format, "scope": scope})
+    return app.get_relative_path("/download/table") + "?" + query
+
+
+@app.callback(
+    Output("bioregion-selection", "options"),
+    Output("zone-selection", "options"),
+    Output("island-selection", "options"),
+    Output("order-selection", "options"),
+    Output("family-selection", "options"),
+    Input("dataset", "value"),
+    Input("bioregion-selection", "value"),
+    Input("zone-selection", "value"),
+    Input("island-selection", "value"),
+    Input("order-selection", "value"),
+    Input("family-selection", "value"),
+    Input("season-selection", "value"),
     Input("year-selection", "value")
 )
-def generate_figures(variable_one, check, variable_two, selectionA, selectionB, selectionC, selectionD, selectionE,
-                     selectionF, selectionG):
-    # Year range generates top and bottom years, a sequence need to be created:
-    selectionG = np.arange(selectionG[0], selectionG[-1]).tolist()
-    # Create a list of selections to use later:
-    selections = [selectionA, selectionB, selectionC, selectionD, selectionE, selectionF, selectionG]
-
-    data_copy = data.copy(deep=True)
-
-    if selections:
-        data_copy = data_copy[
-            data_copy["Bioregion"].isin(selections[0]) &
-            data_copy["Subzone.name"].isin(selections[1]) &
-            data_copy["Island"].isin(selections[2]) &
-            data_copy["ORDER"].isin(selections[3]) &
-            data_copy["Family"].isin(selections[4]) &
-            data_copy["epoca"].isin(selections[5]) &
-            data_copy["year"].isin(selections[6])]
-        data_copy = pd.DataFrame(data_copy)
-        data_copy.reset_index(col_level=1, inplace=True)
+@instrumented("update_filter_options")
+def update_filter_options(dataset_name, selectionA, selectionB, selectionC, selectionD, selectionE, selectionF,
+                          selectionG):
+    # Each checklist only lists the values found with the selections of the other filters
+    dataset = active_dataset(dataset_name)
+    key = filter_state_key(None, False, None,
+                           [selectionA, selectionB, selectionC, selectionD, selectionE], selectionF, selectionG)
+    selections = key_selections(key)[1]
+    options = []
+    for column in FILTER_COLUMNS[:5]:
+        possible = set(dataset.cooccurrence_index.options(column, selections))
+        options.append([{"label": i, "value": i} for i in dataset.artifacts["checklists"][column] if i in possible])
+    return options
 
-    if variable_two is None:
-        # PreventUpdate prevents ALL outputs updating
-        raise dash.exceptions.PreventUpdate
 
-    df = data_copy.groupby(variable_one)["Biomass.250m2"].sum()
-    df = pd.DataFrame(df).sort_values("Biomass.250m2")
-    df = df[df["Biomass.250m2"] > 0]
-    df["Biomass.250m2"] = round(df["Biomass.250m2"], 2)
+@app.callback(
+    Output("bioregion-selection", "value", allow_duplicate=True),
+    Output("zone-selection", "value", allow_duplicate=True),
+    Output("island-selection", "value", allow_duplicate=True),
+    Output("order-selection", "value", allow_duplicate=True),
+    Output("family-selection", "value", allow_duplicate=True),
+    Output("season-selection", "options"),
+    Output("season-selection", "value"),
+    Output("year-selection", "min"),
+    Output("year-selection", "max"),
+    Output("year-selection", "value"),
+    Output("variable-one", "options"),
+    Output("variable-one", "value"),
+    Output("variable-two", "options"),
+    Output("variable-two", "value"),
+    Output("methods-value-cards", "children"),
+    Output("methods-line-chart", "figure"),
+    Output("methods-map", "figure"),
+    Input("dataset", "value"),
+    State("variable-one", "value"),
+    State("variable-two", "value"),
+    prevent_initial_call=True
+)
+@instrumented("switch_dataset")
+def switch_dataset(dataset_name, variable_one, variable_two):
+    # Controls and methods tab of another dataset: every filter value selected, the chart variables kept when the
+    # dataset has them (the charts, tables and map follow from the new values)
+    dataset = active_dataset(dataset_name)
+    artifacts = dataset.artifacts
+    selections, seasons, year_range = default_state(artifacts)
+    variables = [{"label": i, "value": i} for i in dataset.variable_columns]
+    if variable_one not in dataset.variable_columns:
+        variable_one = dataset.variable_columns[0]
+    if variable_two not in dataset.variable_columns:
+        variable_two = dataset.variable_columns[-1]
+    return (*selections,
+            [{"label": i, "value": i} for i in seasons], seasons,
+            year_range[0], year_range[-1], year_range,
+            variables, variable_one, variables, variable_two,
+            [value_cards(label, count) for label, count in artifacts["value_cards"]],
+            artifacts["line_chart"], artifacts["map"])
+
+
+@app.callback(
+    Output("biomass-map", "figure"),
+    Input("dataset", "value"),
+    Input("biomass-map", "relayoutData"),
+    Input("bioregion-selection", "value"),
+    Input("zone-selection", "value"),
+    Input("island-selection", "value"),
+    Input("order-selection", "value"),
+    Input("family-selection", "value"),
+    Input("season-selection", "value"),
+    Input("year-selection", "value")
+)
+@instrumented("update_map")
+def update_map(dataset_name, relayout_data, selectionA, selectionB, selectionC, selectionD, selectionE, selectionF,
+               selectionG):
+    # Only the grid cells in view at the current zoom are aggregated and sent, whatever the number of sites
+    dataset = active_dataset(dataset_name)
+    center, zoom, bounds = viewport(relayout_data, dataset.map_center, map_zoom)
+    key = filter_state_key(None, False, None,
+                           [selectionA, selectionB, selectionC, selectionD, selectionE], selectionF, selectionG)
+    with phase("filter"):
+        lat, long, biomass, records = dataset.spatial_index.query(key_selections(key)[1], zoom, bounds)
+    count("map_cells", len(biomass))
+    with phase("figure"):
+        return compact_figure(biomass_map(lat, long, biomass, records, center, zoom))
+
+
+@app.server.route("/download/table")
+def download_table():
+    # Streams the table of the current view, or the filtered raw records, chunk by chunk
+    args = flask.request.args
+    file_format = args.get("format", "csv")
+    if file_format not in FORMATS or "state" not in args or args.get("dataset") not in datasets:
+        flask.abort(400)
+    try:
+        key = decode_state(args["state"])
+    except (ValueError, TypeError):
+        flask.abort(400)
+    dataset = datasets.get(args["dataset"])
+    if not valid_state(dataset, key):
+        flask.abort(400)
+
+    if args.get("scope") == "raw":
+        _, selections = key_selections(key)
+        frame, mask, name = dataset.data, selection_mask(dataset.data, selections, dataset.partitions), "registros"
+    else:
+        frame, mask, name = view_table_data(dataset, key, None), None, "tabla"
+
+    mimetype, extension = FORMATS[file_format]
+    return flask.Response(stream_frame(frame, file_format, mask), mimetype=mimetype,
+                          headers={"Content-Disposition": 'attachment; filename="{}{}"'.format(name, extension)})
+
+
+@app.server.route("/api/aggregate")
+@instrumented("api_aggregate")
+def api_aggregate():
+    # Read-only aggregates of the charts tab for other dashboards, as JSON or Arrow (see api.py). The view is
+    # chosen with a state token (as in the download links) or one parameter per control, in the dataset parameter
+    # (the first dataset by default).
+    args = flask.request.args
+    file_format = args.get("format", "json")
+    if file_format not in API_FORMATS or args.get("dataset", config.DEFAULT_DATASET) not in datasets:
+        flask.abort(400)
+    dataset = datasets.get(args.get("dataset", config.DEFAULT_DATASET))
+    artifacts = dataset.artifacts
+    try:
+        if "state" in args:
+            key = decode_state(args["state"])
+        else:
+            key = request_state(args, {column: artifacts["checklists"][column] for column in FILTER_COLUMNS[:5]},
+                                artifacts["seasons"], artifacts["years"])
+    except (ValueError, TypeError):
+        flask.abort(400)
+    if not valid_state(dataset, key):
+        flask.abort(400)
+
+    def encode():
+        groups = key_selections(key)[0]
+        column = MEASURES[key[6]]["column"]
+        return encode_view(tidy_table(view_table_data(dataset, key, None), groups, column), key, groups,
+                           key[6], file_format)
+
+    # A repeated request is one cache lookup, and a 304 when the client has the same content
+    return conditional_response(dataset.api_responses.get_or_compute((key, file_format), encode),
+                                API_FORMATS[file_format])
+
+
+def active_dataset(name):
+    # Dataset chosen in the page, loaded if it is not in memory
+    if name not in datasets:
+        raise dash.exceptions.PreventUpdate
+    return datasets.get(name)
+
+
+def valid_state(dataset, key):
+    # Filter state keys from outside the app (links, the API, the log of states) must name known variables and
+    # metrics, and a range within the years of the dataset
+    variable_columns = dataset.variable_columns
+    years = dataset.artifacts["years"]
+    return (key[0] in variable_columns and key[2] in variable_columns + [None] and key[6] in list(MEASURES)
+            and all(isinstance(year, int) for year in key[5]) and years[0] <= key[5][0] <= key[5][-1] <= years[-1])
+
+
+def key_selections(key):
+    # Grouping columns and {filter column: selected values} of a filter state key
+    variable_one, check, variable_two, selections, season, year_range = key[:6]
+    groups = [variable_one, variable_two] if check else [variable_one]
+    # Year range generates top and bottom years (both included): kept as a range, which the indexes resolve as one
+    # slice of the rows sorted by year
+    years_selected = range(year_range[0], year_range[-1] + 1)
+    return groups, dict(zip(FILTER_COLUMNS, [*selections, season, years_selected]))
+
+
+def get_view(dataset, key, session_id):
+    # Aggregate, table data, chart and table of a filter state of a dataset
+    variable_one, check, variable_two = key[:3]
+    metric = key[6]
+
+    # Repeated views are served from the cache without touching the data
+    view = dataset.figures_cache.get(key)
+    if view is not None:
+        count("cache_hits")
+        dataset.session_aggregates.remember(session_id, *key_selections(key), view["aggregate"])
+        return view
+
+    count("cache_misses")
+    aggregate, values, intervals = view_values(dataset, key, session_id)
+    with phase("figure"):
+        view = build_figures(values, variable_one, check, variable_two, metric, intervals)
+    view["aggregate"] = aggregate
+    dataset.figures_cache.set(key, view)
+    return view
+
+
+def view_values(dataset, key, session_id):
+    # Aggregate of a filter state, the metric by group and its intervals: what a view shows, before rendering
+    check = key[1]
+    metric, uncertainty = key[6:8]
+    groups, selections = key_selections(key)
+    aggregate = dataset.session_aggregates.aggregate(session_id, groups, selections)
+    transects = None
+    if not MEASURES[metric]["additive"]:
+        with phase("aggregate"):
+            transects = dataset.effort_index.transects(selections, groups, aggregate.index)
+    values = metric_values(aggregate, transects, metric)
+    intervals = None
+    if uncertainty and not check:
+        with phase("bootstrap"):
+            intervals = metric_intervals(metric, dataset.cube, dataset.filter_index.mask(selections), groups,
+                                         dataset.effort_index, selections, n_resamples=config.BOOTSTRAP_RESAMPLES)
+    return aggregate, values, intervals
+
+
+def view_frames(values, variable_one, check, metric="sum", intervals=None):
+    # Data of the chart and of the table: for two variables the sparse pivot and its whole crosstab, for one
+    # variable the values sorted for the chart and for the table (with the interval bounds, when given)
+    measure = MEASURES[metric]
+    column, decimals = measure["column"], measure["decimals"]
+    if check:
+        # Observed pairs only: the chart densifies just its top rows and columns, the table the whole crosstab
+        pivot = SparsePivot.from_series(values, decimals=decimals)
+        return pivot, pivot.dense(variable_one)
+    df = pd.DataFrame(values).sort_values(column)
+    df = df[df[column] > 0]
+    df[column] = round(df[column], decimals)
+    if intervals is not None:
+        df = df.join(intervals.round(decimals).set_axis(INTERVAL_COLUMNS, axis=1))
     df.reset_index(col_level=0, inplace=True)
-    fig1 = bar_chart_creator(df, variable_one)
-    table1 = create_one_variable_table(df.sort_values("Biomass.250m2", ascending=False), variable_one)
+    return df, df.sort_values(column, ascending=False)
+
+
+def build_figures(values, variable_one, check, variable_two, metric="sum", intervals=None):
+    # values: the metric by variable_one (and variable_two when the second metric is on);
+    # intervals: lower and upper bounds of the values (one variable only)
+    measure = MEASURES[metric]
+    column, decimals = measure["column"], measure["decimals"]
+    # Averages of several categories cannot be added up into "Otros": the smaller categories are left out instead
+    other_label = "Otros" if measure["additive"] else None
+    labels = {"label": measure["title"], "description": measure["description"]}
+    chart_data, df = view_frames(values, variable_one, check, metric, intervals)
     if check:
-        df = data_copy.groupby([variable_one, variable_two]).agg({"Biomass.250m2": "sum"})
-        df.reset_index(col_level=0, inplace=True)
-        df = pd.crosstab(index=df[variable_one], columns=df[variable_two], values=df["Biomass.250m2"], aggfunc="sum")
-        df.reset_index(col_level=0, inplace=True)
-        df.iloc[:] = round(df.iloc[:], 2)
-        fig1 = bivariate_bar_chart_creator(df, variable_one, variable_two)
-        table1 = create_two_variable_table(df, variable_one, variable_two)
-    return fig1, table1
-
+        chart_df = chart_data.trim(config.CHART_TOP_N, config.CHART_TOP_N_COLUMNS, other_label,
+                                   decimals).dense(variable_one)
+        fig1 = compact_figure(bivariate_bar_chart_creator(chart_df, variable_one, variable_two,
+                                                          value_label=measure["axis"], **labels))
+        table1 = create_two_variable_table(df, variable_one, variable_two, page_size=config.TABLE_PAGE_SIZE, **labels)
+    else:
+        errors = INTERVAL_COLUMNS if intervals is not None else None
+        fig1 = compact_figure(bar_chart_creator(chart_data, variable_one, top_n=config.CHART_TOP_N, values=column,
+                                                other_label=other_label, errors=errors, **labels))
+        table1 = create_one_variable_table(df, variable_one, page_size=config.TABLE_PAGE_SIZE, **labels)
+    return {"figure": fig1, "table": table1, "table_data": df}
+
+
+def warm_up_keys(dataset):
+    # Default view of every chart variable, Bioregion first, then the most requested views that are still valid
+    # for the dataset
+    keys = [filter_state_key(column, False, None, *default_state(dataset.artifacts))
+            for column in ["Bioregion"] + dataset.variable_columns]
+    keys += [key for key in dataset.state_log.most_frequent(config.WARMUP_STATES) if valid_state(dataset, key)]
+    return keys
+
+
+# The first users after a start get the common views of the first dataset from the cache
+if config.WARMUP:
+    warm_up(warm_up_keys(datasets.get(config.DEFAULT_DATASET)),
+            lambda key: get_view(datasets.get(config.DEFAULT_DATASET), key, None))
 
 if __name__ == '__main__':
     app.run_server(debug=True)
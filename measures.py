@@ -0,0 +1,98 @@
+import numpy as np
+
+from bootstrap import confidence_intervals
+from cube import MEASURE, RECORDS
+from data_index import column_codes
+from pivot import group_sums
+
+# Metrics of the charts tab: column of the table, option label, chart and table titles, axis label, decimals shown,
+# and whether values of several categories can be added up (the charts only fold the smaller categories into
+# "Otros" for those)
+MEASURES = {
+    "sum": {"column": MEASURE,
+            "label": "Biomasa total",
+            "title": "Biomasa",
+            "description": "Total de biomasa estimada por 250 metros cuadrados",
+            "axis": "Biomasa por 250 m2",
+            "decimals": 2,
+            "additive": True},
+    "transect_mean": {"column": "Biomasa.transecto",
+                      "label": "Biomasa media por transecto",
+                      "title": "Biomasa media por transecto",
+                      "description": "Biomasa media por transecto de 250 metros cuadrados (sitio, año y época), "
+                                     "incluidos los transectos sin registros",
+                      "axis": "Biomasa por transecto",
+                      "decimals": 2,
+                      "additive": False},
+    "density": {"column": "Biomasa.m2",
+                "label": "Densidad de biomasa",
+                "title": "Densidad de biomasa",
+                "description": "Biomasa media por metro cuadrado de transecto",
+                "axis": "Biomasa por m2",
+                "decimals": 4,
+                "additive": False},
+    "records": {"column": "Registros",
+                "label": "Registros",
+                "title": "Registros",
+                "description": "Número de registros",
+                "axis": "Registros",
+                "decimals": 0,
+                "additive": True},
+}
+
+# A transect (sampling unit) is a site surveyed in a year and season, over 250 m2
+TRANSECT_COLUMNS = ["Site", "year", "epoca"]
+TRANSECT_AREA = 250
+# Columns that only depend on the transect: filters and groups on them change the sampling effort
+EFFORT_COLUMNS = ["Bioregion", "Subzone.name", "Island", "Site", "epoca", "year"]
+
+
+class EffortIndex:
+    # Transect of every cube cell, to count the transects sampled in the filtered area and period.
+    # Taxonomic filters do not change the effort: a transect where the selected taxa were not found counts as 0.
+
+    def __init__(self, cube, index):
+        self.cube = cube
+        self.index = index
+        codes = [column_codes(cube[column])[0].astype(np.int64) for column in TRANSECT_COLUMNS]
+        shape = tuple(int(code.max()) + 2 for code in codes)
+        combined = np.ravel_multi_index([code + 1 for code in codes], shape)
+        # First cube cell of each transect, and transect of each cell
+        _, self.first_cell, self.transect = np.unique(combined, return_index=True, return_inverse=True)
+        self.transect = self.transect.ravel()
+
+    def transects(self, selections, groups, group_index):
+        # Number of transects sampled for each group of group_index (the index of an aggregate by groups)
+        scope = self.index.mask({column: values for column, values in selections.items()
+                                 if column in EFFORT_COLUMNS})
+        cells = self.first_cell[np.unique(self.transect[scope])]
+        effort_groups = [column for column in groups if column in EFFORT_COLUMNS]
+        if not effort_groups:
+            return np.full(len(group_index), len(cells), dtype=np.float64)
+        counts = group_sums(self.cube, cells, effort_groups, {})["size"]
+        if len(effort_groups) < len(groups):
+            group_index = group_index.droplevel([groups.index(column) for column in groups
+                                                 if column not in EFFORT_COLUMNS])
+        return counts.reindex(group_index).to_numpy(dtype=np.float64)
+
+
+def metric_values(aggregate, transects, metric):
+    # Values of the metric by group from the aggregate (sum, records and size by group) and the transects
+    if metric == "sum":
+        values = aggregate["sum"]
+    elif metric == "records":
+        values = aggregate["records"]
+    else:
+        values = aggregate["sum"] / transects
+        if metric == "density":
+            values = values / TRANSECT_AREA
+    return values.rename(MEASURES[metric]["column"])
+
+
+def metric_intervals(metric, cube, mask, groups, effort_index, selections, n_resamples=1000):
+    # 95% bootstrap confidence intervals of the metric by group, resampling the transects of each group
+    measure = RECORDS if metric == "records" else MEASURE
+    return confidence_intervals(cube, mask, groups, measure, effort_index.transect,
+                                lambda index: effort_index.transects(selections, groups, index),
+                                per_transect=not MEASURES[metric]["additive"],
+                                area=TRANSECT_AREA if metric == "density" else 1, n_resamples=n_resamples)
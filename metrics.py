@@ -0,0 +1,155 @@
+import contextvars
+import cProfile
+import functools
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import flask
+
+import config
+
+try:
+    import pyinstrument
+except ImportError:  # optional, only for PROFILER = "pyinstrument"
+    pyinstrument = None
+
+# Metrics of the callback running in the current thread/context (None outside instrumented callbacks)
+_current = contextvars.ContextVar("callback_metrics", default=None)
+
+
+class MetricsRegistry:
+    # Totals by callback (and by phase for the timings), exposed in the Prometheus text format
+
+    def __init__(self, prefix="fish_explorer"):
+        self.prefix = prefix
+        self.seconds = defaultdict(float)  # (callback, phase) -> seconds
+        self.calls = defaultdict(int)  # (callback, phase) -> number of timings
+        self.counters = defaultdict(float)  # (counter name, callback) -> total
+        self._lock = threading.Lock()
+
+    def observe(self, callback, phase, seconds):
+        with self._lock:
+            self.seconds[callback, phase] += seconds
+            self.calls[callback, phase] += 1
+
+    def increment(self, name, callback, value=1):
+        with self._lock:
+            self.counters[name, callback] += value
+
+    def prometheus_text(self):
+        lines = ["# HELP {0}_callback_seconds Time spent by the Dash callbacks, by phase".format(self.prefix),
+                 "# TYPE {0}_callback_seconds summary".format(self.prefix)]
+        with self._lock:
+            for (callback, phase), seconds in sorted(self.seconds.items()):
+                labels = '{{callback="{}",phase="{}"}}'.format(callback, phase)
+                lines.append("{}_callback_seconds_sum{} {:.6f}".format(self.prefix, labels, seconds))
+                lines.append("{}_callback_seconds_count{} {}".format(self.prefix, labels, self.calls[callback, phase]))
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append("# TYPE {}_{}_total counter".format(self.prefix, name))
+                for (counter, callback), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append('{}_{}_total{{callback="{}"}} {:g}'.format(self.prefix, name, callback, value))
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def phase(name):
+    # Times a phase ("filter", "aggregate", "figure"...) of the current callback
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = _current.get()
+        if current is not None:
+            registry.observe(current["callback"], name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    # Adds to a counter ("rows_scanned", "cache_hits"...) of the current callback
+    current = _current.get()
+    if current is not None:
+        registry.increment(name, current["callback"], value)
+
+
+class Profiler:
+    # Samples a fraction of the callbacks with cProfile or pyinstrument and writes one report per sampled call
+
+    def __init__(self, kind="", sample_rate=0.0, directory="profiles"):
+        self.kind = kind if kind != "pyinstrument" or pyinstrument is not None else "cprofile"
+        self.sample_rate = sample_rate
+        self.directory = directory
+
+    def enabled(self):
+        return bool(self.kind) and random.random() < self.sample_rate
+
+    def run(self, name, func, *args, **kwargs):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "{}-{}".format(name, time.strftime("%Y%m%d-%H%M%S")))
+        if self.kind == "pyinstrument":
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.stop()
+                with open(path + ".html", "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            profiler.dump_stats(path + ".prof")
+
+
+profiler = Profiler(config.PROFILER, config.PROFILE_SAMPLE_RATE, config.PROFILE_DIR)
+
+
+def instrumented(name):
+    # Decorator for the Dash callbacks: total time, phases and counters, plus optional profiling
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current.set({"callback": name})
+            start = time.perf_counter()
+            try:
+                if profiler.enabled():
+                    return profiler.run(name, func, *args, **kwargs)
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                registry.observe(name, "total", seconds)
+                _current.reset(token)
+                if flask.has_request_context():
+                    # Read by the after_request hook to measure serialization and payload
+                    flask.g.callback_metrics = (name, seconds)
+        return wrapper
+    return decorator
+
+
+def init_app(server, path="/metrics"):
+    # Request timing hooks for the Dash updates and the Prometheus endpoint on the Flask server
+    @server.before_request
+    def start_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_response(response):
+        callback_metrics = getattr(flask.g, "callback_metrics", None)
+        if callback_metrics is not None and not response.direct_passthrough:
+            name, seconds = callback_metrics
+            # Everything in the request that is not the callback itself: mostly the JSON serialization
+            registry.observe(name, "serialize", time.perf_counter() - flask.g.request_start - seconds)
+            registry.increment("payload_bytes", name, len(response.get_data()))
+        return response
+
+    @server.route(path)
+    def metrics_endpoint():
+        return flask.Response(registry.prometheus_text(), mimetype="text/plain; version=0.0.4")
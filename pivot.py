@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from data_index import column_codes
+from helpers import top_n_positions
+
+# Above this number of possible groups the combined codes are compacted with np.unique instead of one bincount slot
+# per possible group
+DENSE_GROUPS_LIMIT = 1 << 22
+
+
+def group_sums(df, mask, groups, measures):
+    # Sums of the measures ({output column: column}) and number of rows by groups over the masked rows (a boolean
+    # mask or row positions), in one pass over the integer codes: the codes of the group columns are combined into
+    # one number per row and every measure is added up with bincount on it.
+    # Same result as df[mask].groupby(groups, observed=True).agg(sum of each measure, size).
+    codes, values = [], []
+    for column in groups:
+        column_code, column_values = column_codes(df[column])
+        codes.append(column_code[mask])
+        values.append(column_values)
+    present = np.logical_and.reduce([code >= 0 for code in codes])
+    shape = tuple(max(len(column_values), 1) for column_values in values)
+    combined = np.ravel_multi_index([code[present] for code in codes], shape)
+
+    dense = np.prod(shape, dtype=np.float64) <= DENSE_GROUPS_LIMIT
+    if dense:
+        slots, n_slots = combined, int(np.prod(shape))
+    else:
+        keys, slots = np.unique(combined, return_inverse=True)
+        n_slots = len(keys)
+    size = np.bincount(slots, minlength=n_slots)
+    if dense:
+        keys = np.flatnonzero(size)
+    observed = keys if dense else slice(None)
+    sums = {}
+    for name, column in measures.items():
+        # NaN measures count as 0, like groupby sum
+        weights = np.nan_to_num(df[column].to_numpy()[mask][present].astype(np.float64))
+        sums[name] = np.bincount(slots, weights=weights, minlength=n_slots)[observed]
+    size = size[observed]
+
+    levels = []
+    for column, column_values, level_codes in zip(groups, values, np.unravel_index(keys, shape)):
+        dtype = df[column].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            levels.append(pd.Categorical.from_codes(level_codes, dtype=dtype))
+        else:
+            levels.append(np.asarray(column_values, dtype=dtype)[level_codes])
+    if len(groups) == 1:
+        index = pd.Index(levels[0], name=groups[0])
+    else:
+        index = pd.MultiIndex.from_arrays(levels, names=groups)
+    return pd.DataFrame({**sums, "size": size}, index=index)
+
+
+class SparsePivot:
+    # Two-way totals kept as (row, column, value) triplets of the observed pairs only. The dense crosstab
+    # (first column with the row names, one column per column value, NaN for the missing pairs) is only
+    # built for rendering, after trimming to the top rows and columns for the chart.
+
+    def __init__(self, rows, columns, row_codes, column_codes, values):
+        self.rows = rows
+        self.columns = columns
+        self.row_codes = row_codes
+        self.column_codes = column_codes
+        self.values = values
+
+    @classmethod
+    def from_series(cls, series, decimals=None):
+        # series indexed by (row value, column value); rows and columns are sorted like sort_index
+        row_codes, rows = pd.factorize(series.index.get_level_values(0).astype(object), sort=True)
+        column_codes, columns = pd.factorize(series.index.get_level_values(1).astype(object), sort=True)
+        values = series.to_numpy(dtype=np.float64)
+        if decimals is not None:
+            values = values.round(decimals)
+        return cls(list(rows), list(columns), row_codes, column_codes, values)
+
+    def trim(self, n_rows, n_columns, other_label="Otros", decimals=2):
+        # Top n_columns columns and then top n_rows rows by total; the other columns and then the other rows are
+        # added up in an "Otros" column and row, placed last (other_label=None drops them)
+        pivot = self
+        if n_columns is not None and len(pivot.columns) > n_columns + 1:
+            pivot = pivot._fold(1, n_columns, other_label, decimals)
+        if n_rows is not None and len(pivot.rows) > n_rows + 1:
+            pivot = pivot._fold(0, n_rows, other_label, decimals)
+        return pivot
+
+    def _fold(self, axis, n, other_label, decimals):
+        labels, codes = (self.rows, self.row_codes) if axis == 0 else (self.columns, self.column_codes)
+        keep = np.zeros(len(labels), dtype=bool)
+        keep[top_n_positions(np.bincount(codes, weights=self.values, minlength=len(labels)), n)] = True
+        # Kept labels keep their order, every other label goes to the new last position
+        remap = np.full(len(labels), keep.sum())
+        remap[keep] = np.arange(keep.sum())
+        new_labels = [label for label, kept in zip(labels, keep) if kept]
+        if other_label is None:
+            cells = keep[codes]
+            if axis == 0:
+                return SparsePivot(new_labels, self.columns, remap[codes[cells]], self.column_codes[cells],
+                                   self.values[cells])
+            return SparsePivot(self.rows, new_labels, self.row_codes[cells], remap[codes[cells]], self.values[cells])
+
+        new_labels.append(other_label)
+        rows, columns = (new_labels, self.columns) if axis == 0 else (self.rows, new_labels)
+        row_codes, column_codes = (remap[codes], self.column_codes) if axis == 0 else (self.row_codes, remap[codes])
+        # Cells that now share a position (only the folded ones do) are added up
+        keys, inverse = np.unique(row_codes * len(columns) + column_codes, return_inverse=True)
+        values = np.bincount(inverse, weights=self.values, minlength=len(keys))
+        row_codes, column_codes = np.divmod(keys, len(columns))
+        folded = (row_codes if axis == 0 else column_codes) == len(new_labels) - 1
+        values[folded] = values[folded].round(decimals)
+        return SparsePivot(rows, columns, row_codes, column_codes, values)
+
+    def dense(self, index_name):
+        matrix = np.full((len(self.rows), len(self.columns)), np.nan)
+        matrix[self.row_codes, self.column_codes] = self.values
+        df = pd.DataFrame(matrix, columns=pd.Index(self.columns, dtype=object))
+        df.insert(0, index_name, pd.Series(self.rows, dtype=object))
+        return df
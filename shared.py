@@ -0,0 +1,85 @@
+import argparse
+import logging
+import signal
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import pyarrow as pa
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Every segment starts with the length of the Arrow IPC file stored after it
+HEADER = struct.Struct("<Q")
+
+# Segments attached by this process: they must stay open while the frames built on them are in use
+_segments = []
+
+
+def cube_segment_name(name):
+    return name + "-cube"
+
+
+def publish_frame(df, name):
+    # Copies df to a new shared memory segment as an Arrow IPC file; the caller owns (and unlinks) the segment
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sizer = pa.MockOutputStream()
+    with pa.ipc.new_file(sizer, table.schema) as writer:
+        writer.write_table(table)
+    size = sizer.size()
+
+    segment = SharedMemory(name=name, create=True, size=HEADER.size + size)
+    HEADER.pack_into(segment.buf, 0, size)
+    stream = pa.FixedSizeBufferWriter(pa.py_buffer(segment.buf[HEADER.size:HEADER.size + size]))
+    with pa.ipc.new_file(stream, table.schema) as writer:
+        writer.write_table(table)
+    logger.info("Published %d rows in shared memory segment %s (%.1f MB)", len(df), name, size / 2 ** 20)
+    return segment
+
+
+def attach_frame(name):
+    # DataFrame over the Arrow buffers of a published segment: the columns are read in place, not copied
+    segment = SharedMemory(name=name)
+    # Attaching must not make this process unlink the segment when it exits (only the publisher does)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except (AttributeError, KeyError):
+        pass
+    _segments.append(segment)
+
+    (size,) = HEADER.unpack_from(segment.buf, 0)
+    buffer = pa.py_buffer(segment.buf)[HEADER.size:HEADER.size + size]
+    table = pa.ipc.open_file(buffer).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def publish(name):
+    # Loads the dataset and its cube once and keeps them in shared memory until the process is stopped
+    from cube import build_cube
+    from loader import load_dataset
+
+    data = load_dataset(config.DATASETS[config.DEFAULT_DATASET])
+    segments = [publish_frame(data, name), publish_frame(build_cube(data), cube_segment_name(name))]
+    del data
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Publish the dataset in shared memory for the app workers")
+    parser.add_argument("--name", default=config.SHARED_MEMORY_NAME or "fish-data",
+                        help="shared memory segment name (workers read it from FISH_SHARED_MEMORY)")
+    publish(parser.parse_args().name)
@@ -0,0 +1,82 @@
+import numpy as np
+
+from data_index import FILTER_COLUMNS, FilterIndex
+
+# Web map zoom levels with a precomputed grid
+ZOOM_LEVELS = list(range(5, 17))
+# Grid cells are 1/8 of a 256 px map tile: about 32 px on screen at every zoom level
+CELLS_PER_TILE = 8
+
+
+def cell_size(zoom):
+    # Side of a grid cell in degrees (close enough to square at the latitude of Galápagos)
+    return 360 / (2 ** zoom * CELLS_PER_TILE)
+
+
+class SpatialIndex:
+    # Survey points (biomass and records summed by filter values and coordinates) binned in a grid for each zoom
+    # level. A query adds up the filtered points of each cell with bincount and returns only the cells in the
+    # viewport, so the number of markers depends on the screen, not on the number of sites or records.
+
+    def __init__(self, df, lat="Latitude", long="Longitude", measure="Biomass.250m2", columns=FILTER_COLUMNS):
+        points = df.groupby(columns + [lat, long], observed=True, dropna=False)[measure].agg(["sum", "size"])
+        points = points.reset_index()
+        points = points[points[lat].notna() & points[long].notna()].reset_index(drop=True)
+        self.index = FilterIndex(points, columns)
+        self.biomass = points["sum"].to_numpy(dtype=float)
+        self.records = points["size"].to_numpy(dtype=float)
+        self.lat = points[lat].to_numpy(dtype=float)
+        self.long = points[long].to_numpy(dtype=float)
+
+        # For every level: dense cell number of each point and the (row, column) of each cell in the grid
+        self.levels = {}
+        for zoom in ZOOM_LEVELS:
+            size = cell_size(zoom)
+            cells = np.stack([np.floor(self.lat / size), np.floor(self.long / size)], axis=1).astype(np.int64)
+            grid, point_cells = np.unique(cells, axis=0, return_inverse=True)
+            self.levels[zoom] = (point_cells.ravel(), grid)
+
+    def memory(self):
+        # Bytes of the points, their bitmaps and the grids of every level
+        return (self.index.memory() + sum(values.nbytes for values in (self.biomass, self.records, self.lat, self.long))
+                + sum(point_cells.nbytes + grid.nbytes for point_cells, grid in self.levels.values()))
+
+    def level(self, zoom):
+        return min(max(int(zoom), ZOOM_LEVELS[0]), ZOOM_LEVELS[-1])
+
+    def query(self, selections, zoom, bounds=None):
+        # Cells with records for the selections at the zoom level, inside bounds (south, west, north, east).
+        # Returns latitude and longitude (record-weighted centre of the points), biomass and records per cell.
+        point_cells, grid = self.levels[self.level(zoom)]
+        mask = self.index.mask(selections)
+        n_cells = len(grid)
+        cells = point_cells[mask]
+        records = np.bincount(cells, weights=self.records[mask], minlength=n_cells)
+        biomass = np.bincount(cells, weights=self.biomass[mask], minlength=n_cells)
+        lat = np.bincount(cells, weights=(self.lat * self.records)[mask], minlength=n_cells)
+        long = np.bincount(cells, weights=(self.long * self.records)[mask], minlength=n_cells)
+
+        keep = records > 0
+        if bounds is not None:
+            size = cell_size(self.level(zoom))
+            south, west, north, east = bounds
+            keep &= (grid[:, 0] >= np.floor(south / size)) & (grid[:, 0] <= np.floor(north / size))
+            keep &= (grid[:, 1] >= np.floor(west / size)) & (grid[:, 1] <= np.floor(east / size))
+        records = records[keep]
+        return lat[keep] / records, long[keep] / records, biomass[keep], records
+
+
+def viewport(relayout_data, center, zoom, width=1200, height=600):
+    # Centre, zoom and bounds (south, west, north, east) of the map after a relayout event. The bounds come from
+    # the corners reported by plotly.js, or are estimated from the figure size when they are missing.
+    relayout_data = relayout_data or {}
+    center = relayout_data.get("mapbox.center", center)
+    zoom = relayout_data.get("mapbox.zoom", zoom)
+    corners = (relayout_data.get("mapbox._derived") or {}).get("coordinates")
+    if corners:
+        longs, lats = zip(*corners)
+        return center, zoom, (min(lats), min(longs), max(lats), max(longs))
+    degrees_per_pixel = 360 / (256 * 2 ** zoom)
+    half_height, half_width = height / 2 * degrees_per_pixel, width / 2 * degrees_per_pixel
+    return center, zoom, (center["lat"] - half_height, center["lon"] - half_width,
+                          center["lat"] + half_height, center["lon"] + half_width)
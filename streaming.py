@@ -0,0 +1,89 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Rows converted and sent at a time
+CHUNK_ROWS = 50_000
+
+# Download formats: (mimetype, file extension)
+FORMATS = {"csv": ("text/csv", ".csv"),
+           "parquet": ("application/vnd.apache.parquet", ".parquet"),
+           "feather": ("application/vnd.apache.arrow.file", ".feather")}
+
+
+class ChunkSink:
+    # Write-only file object for the Arrow writers: keeps what was written until the next drain()
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def iter_chunks(df, mask=None, chunk_rows=CHUNK_ROWS):
+    # Frames of at most chunk_rows rows of df (only the rows of the mask, when given)
+    rows = np.flatnonzero(mask) if mask is not None else np.arange(len(df))
+    for start in range(0, len(rows), chunk_rows):
+        yield df.iloc[rows[start: start + chunk_rows]]
+
+
+def stream_csv(chunks, columns):
+    # The header alone when there are no rows
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header).encode("utf-8")
+        header = False
+    if header:
+        yield columns.to_csv(index=False).encode("utf-8")
+
+
+def stream_arrow(chunks, file_format, schema):
+    # Parquet (one row group per chunk) or Feather/Arrow IPC (one record batch per chunk)
+    sink = ChunkSink()
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_schema(df):
+    # Column types of the Arrow writers. Object columns are text: an empty frame would type them as null, and the
+    # chunks with values would not fit the schema.
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+
+def stream_frame(df, file_format, mask=None, chunk_rows=CHUNK_ROWS):
+    # Generator of the bytes of the selected rows of df in the given format, built chunk by chunk
+    chunks = iter_chunks(df, mask, chunk_rows)
+    if file_format == "csv":
+        return stream_csv(chunks, df.iloc[:0])
+    return stream_arrow(chunks, file_format, arrow_schema(df))
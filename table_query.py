@@ -0,0 +1,93 @@
+import math
+
+import pandas as pd
+
+# DataTable filter operators (filter_action="custom") and their pandas equivalent
+OPERATORS = [["ge ", ">="],
+             ["le ", "<="],
+             ["lt ", "<"],
+             ["gt ", ">"],
+             ["ne ", "!="],
+             ["eq ", "="],
+             ["contains "],
+             ["datestartswith "]]
+
+
+def split_filter_part(filter_part):
+    # "{Island} contains Isa" -> ("Island", "contains", "Isa"). The value is kept as text: filter_frame reads it as
+    # a number only to compare it with a numeric column.
+    for operator_type in OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find("{") + 1: name_part.rfind("}")]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ""
+                if v0 == value_part[-1:] and v0 in ("'", '"', "`"):
+                    value = value_part[1: -1].replace("\\" + v0, v0)
+                else:
+                    value = value_part
+
+                # word operators need spaces after them in the filter string, but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
+
+
+def comparable(series, value):
+    # Numeric columns are compared with numbers (a value that is not a number is never equal, greater or less),
+    # every other column (categories included) as text
+    if pd.api.types.is_numeric_dtype(series):
+        try:
+            return series, float(value)
+        except ValueError:
+            return series, float("nan")
+    return series.astype(str), value
+
+
+def filter_frame(df, filter_query):
+    for filter_part in (filter_query or "").split(" && "):
+        column, operator, value = split_filter_part(filter_part)
+        if column not in df:
+            continue
+        if operator in ("eq", "ne", "lt", "le", "gt", "ge"):
+            series, value = comparable(df[column], value)
+            df = df.loc[getattr(series, operator)(value)]
+        elif operator == "contains":
+            df = df.loc[df[column].astype(str).str.contains(value, case=False, regex=False)]
+        elif operator == "datestartswith":
+            df = df.loc[df[column].astype(str).str.startswith(value)]
+    return df
+
+
+def sort_key(series):
+    # Categories are in the order they were found in the file: they are sorted by their text instead
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object)
+    return series
+
+
+def sort_frame(df, sort_by):
+    sort_by = [sort for sort in (sort_by or []) if sort["column_id"] in df]
+    if not sort_by:
+        return df
+    return df.sort_values([sort["column_id"] for sort in sort_by],
+                          ascending=[sort["direction"] == "asc" for sort in sort_by],
+                          na_position="last",
+                          kind="stable",
+                          key=sort_key)
+
+
+def table_page(df, page_current=0, page_size=25, sort_by=None, filter_query=None):
+    # Records of the requested page after filtering and sorting, and the number of pages
+    df = sort_frame(filter_frame(df, filter_query), sort_by)
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    page_current = min(page_current or 0, page_count - 1)
+    page = df.iloc[page_current * page_size: (page_current + 1) * page_size]
+    return page.to_dict("records"), page_count
+
+
+def table_columns(df):
+    return [{"name": i, "id": i, "type": "numeric" if pd.api.types.is_numeric_dtype(df[i]) else "text"}
+            for i in df.columns]
@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The app modules are flat at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import synthetic_survey  # noqa: E402
+from cube import build_cube  # noqa: E402
+from data_index import prepare_data, sort_partitions  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def survey():
+    # Small survey dataset with missing values in a filter column and a measure, and an object (not categorical)
+    # copy of a column, sorted by year like the loaded datasets
+    df = synthetic_survey(3000, sites=40, species=60, families=15, orders=6, seed=3)
+    rng = np.random.default_rng(3)
+    df.loc[rng.random(len(df)) < 0.03, "Island"] = np.nan
+    df.loc[rng.random(len(df)) < 0.02, "Biomass.250m2"] = np.nan
+    df = sort_partitions(prepare_data(df))
+    df["Family.text"] = df["Family"].astype(object)
+    return df
+
+
+@pytest.fixture(scope="session")
+def cube(survey):
+    return build_cube(survey.drop(columns="Family.text"))
+
+
+def reference_mask(df, selections):
+    # Rows whose value is among the selected ones in every filtered column (missing values never match)
+    mask = np.ones(len(df), dtype=bool)
+    for column, values in selections.items():
+        mask &= df[column].isin(list(values or [])).to_numpy()
+    return mask
+
+
+@pytest.fixture(scope="session")
+def app_main(tmp_path_factory):
+    # The app (main.py) on a small synthetic dataset, with its artifacts in a temporary folder. The settings are
+    # read again, other tests may have imported config.py already.
+    import importlib
+
+    import config
+    from loader import write_partitioned
+    directory = tmp_path_factory.mktemp("app")
+    write_partitioned(synthetic_survey(2000, sites=30, species=40, families=12, seed=5),
+                      str(directory / "fish.feather"))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("FISH_DATA_PATH", str(directory / "fish.feather"))
+        patch.delenv("FISH_DATASETS", raising=False)
+        patch.setenv("FISH_ARTIFACTS_DIR", str(directory / "artifacts"))
+        patch.setenv("FISH_WARMUP", "0")
+        patch.setenv("FISH_BACKGROUND_CALLBACKS", "0")
+        importlib.reload(config)
+        import main
+    return main
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregation import SessionAggregates
+from conftest import reference_mask
+from cube import MEASURE, RECORDS
+from data_index import FILTER_COLUMNS, FilterIndex
+
+
+def every_value(cube):
+    return {column: cube[column].dropna().unique().tolist() for column in FILTER_COLUMNS}
+
+
+def reference_aggregate(cube, selections, groups):
+    # Sum, records and number of cube cells by groups over the selected cells
+    grouped = cube[reference_mask(cube, selections)].groupby(groups, observed=True)
+    return pd.DataFrame({"sum": grouped[MEASURE].sum(), "records": grouped[RECORDS].sum(), "size": grouped.size()})
+
+
+def assert_same_aggregate(result, expected):
+    assert result.index.astype(object).tolist() == expected.index.astype(object).tolist()
+    for column in ["sum", "records", "size"]:
+        np.testing.assert_allclose(result[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize("groups", [["Island"], ["Family", "epoca"]])
+def test_delta_matches_full_roll_up(cube, groups):
+    aggregates = SessionAggregates(cube, FilterIndex(cube, FILTER_COLUMNS))
+    selections = every_value(cube)
+    rng = np.random.default_rng(4)
+    aggregates.aggregate("session", groups, selections)
+    for _ in range(40):
+        # Toggle a few values of one filter, like a click in a checklist or a move of the year slider
+        column = FILTER_COLUMNS[rng.integers(len(FILTER_COLUMNS))]
+        values = cube[column].dropna().unique().tolist()
+        toggled = set(rng.choice(values, size=rng.integers(1, 3), replace=False).tolist())
+        selections = dict(selections, **{column: sorted(set(selections[column]) ^ toggled)})
+        result = aggregates.aggregate("session", groups, selections)
+        assert_same_aggregate(result, reference_aggregate(cube, selections, groups))
+    assert aggregates.delta_computations > 0
+
+
+def test_delta_through_empty_selection(cube):
+    aggregates = SessionAggregates(cube, FilterIndex(cube, FILTER_COLUMNS))
+    selections = every_value(cube)
+    islands = selections["Island"]
+    aggregates.aggregate("session", ["Family"], dict(selections, Island=islands[:1]))
+
+    empty = aggregates.aggregate("session", ["Family"], dict(selections, Island=[]))
+    assert empty.empty
+    assert aggregates.delta_computations == 1
+
+    result = aggregates.aggregate("session", ["Family"], dict(selections, Island=islands[:2]))
+    assert_same_aggregate(result, reference_aggregate(cube, dict(selections, Island=islands[:2]), ["Family"]))
+
+
+def test_delta_only_for_a_single_column(cube):
+    aggregates = SessionAggregates(cube, FilterIndex(cube, FILTER_COLUMNS))
+    selections = every_value(cube)
+    aggregates.aggregate("session", ["Island"], selections)
+    changed = dict(selections, Island=selections["Island"][1:], epoca=selections["epoca"][:1])
+    result = aggregates.aggregate("session", ["Island"], changed)
+    assert aggregates.delta_computations == 0 and aggregates.full_computations == 2
+    assert_same_aggregate(result, reference_aggregate(cube, changed, ["Island"]))
+
+
+def test_delta_of_year_ranges(cube):
+    aggregates = SessionAggregates(cube, FilterIndex(cube, FILTER_COLUMNS))
+    selections = dict(every_value(cube), year=range(2004, 2021))
+    for low, high in [(2004, 2020), (2008, 2020), (2008, 2012), (2015, 2016), (2004, 2020)]:
+        selections = dict(selections, year=range(low, high + 1))
+        result = aggregates.aggregate("session", ["Island"], selections)
+        assert_same_aggregate(result, reference_aggregate(cube, selections, ["Island"]))
+    assert aggregates.delta_computations == 4
+
+
+def test_huge_year_range(cube):
+    # Years are compared within the years of the cube: a range of two billion years is not expanded
+    aggregates = SessionAggregates(cube, FilterIndex(cube, FILTER_COLUMNS))
+    selections = dict(every_value(cube), year=range(2004, 2021))
+    expected = aggregates.aggregate("session", ["Island"], selections)
+    result = aggregates.aggregate("session", ["Island"], dict(selections, year=range(2004, 2_000_000_000)))
+    assert_same_aggregate(result, expected)
+    result = aggregates.aggregate("session", ["Island"], dict(selections, year=range(2010, 2_000_000_000)))
+    assert_same_aggregate(result, reference_aggregate(cube, dict(selections, year=range(2010, 2021)), ["Island"]))
+    assert aggregates.delta_computations == 1
@@ -0,0 +1,110 @@
+import flask
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from api import GZIP_MIN_BYTES, conditional_response, request_state
+from cache import encode_state, filter_state_key
+
+OPTIONS = {"Bioregion": ["A", "B"], "Subzone.name": ["Z"], "Island": ["I1", "I2"], "ORDER": ["O"], "Family": ["F"]}
+SEASONS = ["Caliente", "Fría"]
+YEARS = [2004, 2005, 2010, 2020]
+
+
+def state(query):
+    return request_state(MultiDict(query), OPTIONS, SEASONS, YEARS)
+
+
+def test_request_state_defaults():
+    assert state([]) == filter_state_key("Bioregion", False, None, list(OPTIONS.values()), SEASONS, [2004, 2020])
+
+
+def test_request_state_parameters():
+    key = state([("variable_one", "Island"), ("variable_two", "Family"), ("Island", "I2"), ("epoca", "Fría"),
+                 ("years", "2010"), ("metric", "density"), ("uncertainty", "true")])
+    assert key == filter_state_key("Island", True, "Family", [["A", "B"], ["Z"], ["I2"], ["O"], ["F"]], ["Fría"],
+                                   [2010, 2010], "density", True)
+
+
+@pytest.mark.parametrize("years, expected", [("2004-2020", (2004, 2020)), ("2000-2008", (2004, 2008)),
+                                             ("2015-2000000000", (2015, 2020)), ("1-2000000000", (2004, 2020))])
+def test_request_state_years_are_cut_to_the_dataset(years, expected):
+    assert state([("years", years)])[5] == expected
+
+
+@pytest.mark.parametrize("years", ["a-b", "1-2-3", "1990-2000", "2021-2030", "2010-2005", ""])
+def test_request_state_rejects_years(years):
+    with pytest.raises(ValueError):
+        state([("years", years)])
+
+
+@pytest.fixture
+def encoded():
+    import gzip
+    body = b'{"data": []}' * GZIP_MIN_BYTES
+    return {"etag": "abc", "body": body, "gzip": gzip.compress(body)}
+
+
+def test_conditional_response(encoded):
+    app = flask.Flask(__name__)
+    with app.test_request_context():
+        response = conditional_response(encoded, "application/json")
+        assert response.status_code == 200 and response.get_data() == encoded["body"]
+        assert response.headers["ETag"] == '"abc"' and "Content-Encoding" not in response.headers
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = conditional_response(encoded, "application/json")
+        assert response.get_data() == encoded["gzip"] and response.headers["Content-Encoding"] == "gzip"
+        # The gzipped body is another representation, with its own ETag
+        assert response.headers["ETag"] == '"abc-gzip"'
+    with app.test_request_context(headers={"If-None-Match": '"abc"'}):
+        response = conditional_response(encoded, "application/json")
+        assert response.status_code == 304 and response.get_data() == b""
+    with app.test_request_context(headers={"If-None-Match": '"abc"', "Accept-Encoding": "gzip"}):
+        assert conditional_response(encoded, "application/json").status_code == 200
+
+
+def test_small_responses_are_not_compressed(encoded):
+    app = flask.Flask(__name__)
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        response = conditional_response(dict(encoded, gzip=None), "application/json")
+        assert response.get_data() == encoded["body"] and "Content-Encoding" not in response.headers
+
+
+def test_api_years(app_main):
+    client = app_main.app.server.test_client()
+    first = client.get("/api/aggregate?years=2004-2020")
+    assert first.status_code == 200
+    # A range beyond the data is the same view
+    assert client.get("/api/aggregate?years=2000-2000000000").get_data() == first.get_data()
+    assert client.get("/api/aggregate?years=2030-2040").status_code == 400
+
+
+def test_state_tokens_outside_the_years_are_rejected(app_main):
+    client = app_main.app.server.test_client()
+    selections = app_main.default_state(app_main.artifacts)[0]
+    for year_range, status in [([2004, 2020], 200), ([2004, 2000000000], 400), ([1, 2020], 400),
+                               ([2012, 2010], 400)]:
+        token = encode_state(filter_state_key("Island", False, None, selections, SEASONS, year_range))
+        assert client.get("/api/aggregate?state=" + token).status_code == status
+        assert client.get("/download/table?dataset=fish&format=csv&state=" + token).status_code == status
+
+
+@pytest.mark.parametrize("query", ["variable_one=Island", "variable_one=Island&variable_two=Family",
+                                   "variable_one=Family&metric=density&uncertainty=1"])
+def test_api_does_not_render(app_main, monkeypatch, query):
+    dataset = app_main.datasets.get("fish")
+    client = app_main.app.server.test_client()
+
+    def build_figures(*args, **kwargs):
+        raise AssertionError("the API rendered a chart")
+
+    monkeypatch.setattr(app_main, "build_figures", build_figures)
+    dataset.api_responses.clear()
+    dataset.figures_cache.clear()
+    response = client.get("/api/aggregate?format=json&" + query)
+    assert response.status_code == 200
+    monkeypatch.undo()
+
+    # Same data as the table of the rendered view
+    dataset.api_responses.clear()
+    app_main.get_view(dataset, app_main.decode_state(response.get_json()["state"]), None)
+    assert client.get("/api/aggregate?format=json&" + query).get_data() == response.get_data()
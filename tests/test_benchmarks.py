@@ -0,0 +1,16 @@
+from benchmarks.run import missing_baselines, regressions
+
+RESULTS = {"10000": {"figures": {"seconds": 0.3, "peak_mb": 12.0}, "table": {"seconds": 0.1, "peak_mb": None}}}
+
+
+def test_regressions():
+    baselines = {"10000": {"figures": {"seconds": 0.1, "peak_mb": 11.0}, "table": {"seconds": 0.2, "peak_mb": 1.0}}}
+    assert regressions(RESULTS, baselines, 0.5) == ["10000 rows, figures: seconds 0.3 > baseline 0.1"]
+    assert regressions(RESULTS, baselines, 2.5) == []
+    assert missing_baselines(RESULTS, baselines) == []
+
+
+def test_missing_baselines():
+    baselines = {"10000": {"figures": {"seconds": 1.0, "peak_mb": 20.0}}, "1000000": {}}
+    assert missing_baselines(RESULTS, baselines) == ["10000 rows, table"]
+    assert missing_baselines(RESULTS, {}) == ["10000 rows, figures", "10000 rows, table"]
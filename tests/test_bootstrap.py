@@ -0,0 +1,73 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bootstrap
+from bootstrap import confidence_intervals
+from cube import MEASURE
+
+GROUPS = ["Island", "epoca"]
+
+
+@pytest.fixture(scope="module")
+def transect(survey):
+    # Transect (site, year and season) of every record
+    return pd.MultiIndex.from_frame(survey[["Site", "year", "epoca"]].astype(object)).factorize()[0]
+
+
+def transects_with_records(survey, mask, transect):
+    # Number of transects by group among the selected records (every transect of the test has records)
+    def transects(group_index):
+        counts = pd.Series(transect[mask]).groupby([survey[column].to_numpy()[mask] for column in GROUPS]).nunique()
+        return counts.reindex(group_index).to_numpy()
+    return transects
+
+
+def intervals(survey, mask, transect, **kwargs):
+    return confidence_intervals(survey, mask, GROUPS, MEASURE, transect, transects_with_records(survey, mask, transect),
+                                n_resamples=200, **kwargs)
+
+
+def test_intervals_contain_the_totals(survey, transect):
+    mask = survey["year"].between(2008, 2014).to_numpy()
+    result = intervals(survey, mask, transect)
+    totals = survey[mask].groupby(GROUPS, observed=True)[MEASURE].sum()
+    assert list(result.columns) == ["lower", "upper"]
+    assert result.index.names == GROUPS
+    assert sorted(result.index.tolist()) == sorted(totals.index.tolist())
+    totals = totals.reindex(result.index)
+    assert (result["lower"] <= totals + 1e-9).all() and (totals <= result["upper"] + 1e-9).all()
+
+
+def test_intervals_are_reproducible(survey, transect):
+    mask = np.ones(len(survey), dtype=bool)
+    pd.testing.assert_frame_equal(intervals(survey, mask, transect, seed=4), intervals(survey, mask, transect, seed=4))
+    assert not intervals(survey, mask, transect, seed=4).equals(intervals(survey, mask, transect, seed=5))
+
+
+def test_intervals_per_transect_and_area(survey, transect):
+    mask = survey["epoca"].eq("Fría").to_numpy()
+    totals = intervals(survey, mask, transect)
+    n_transects = transects_with_records(survey, mask, transect)(totals.index)
+    means = intervals(survey, mask, transect, per_transect=True, area=250)
+    np.testing.assert_allclose(means.to_numpy(), totals.to_numpy() / n_transects[:, None] / 250, rtol=1e-9)
+
+
+def test_intervals_empty_selection(survey, transect):
+    result = intervals(survey, np.zeros(len(survey), dtype=bool), transect)
+    assert result.empty and list(result.columns) == ["lower", "upper"]
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="the pool forks its workers")
+def test_pool_gives_the_same_resamples(survey, transect, monkeypatch):
+    # Small batches: the resamples are split in several batches, computed by the workers or in this process
+    monkeypatch.setattr(bootstrap, "BATCH_DRAWS", 2000)
+    mask = np.ones(len(survey), dtype=bool)
+    monkeypatch.setattr(bootstrap, "get_pool", lambda: None)
+    expected = intervals(survey, mask, transect)
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("fork")) as pool:
+        monkeypatch.setattr(bootstrap, "get_pool", lambda: pool)
+        pd.testing.assert_frame_equal(intervals(survey, mask, transect), expected)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from conftest import reference_mask
+from data_index import (FILTER_COLUMNS, CooccurrenceIndex, FilterIndex, PartitionOffsets, range_bits,
+                        selection_mask)
+
+
+def sample_selections(df, rng, columns=FILTER_COLUMNS):
+    # Random subset of the values of every column (missing values are never offered in the checklists)
+    selections = {}
+    for column in columns:
+        values = sorted(df[column].dropna().unique().tolist())
+        selections[column] = rng.choice(values, size=rng.integers(1, len(values) + 1), replace=False).tolist()
+    return selections
+
+
+def test_filter_index_matches_isin(survey):
+    index = FilterIndex(survey, FILTER_COLUMNS, partition_column=None)
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        selections = sample_selections(survey, rng)
+        np.testing.assert_array_equal(index.mask(selections), reference_mask(survey, selections))
+
+
+def test_filter_index_missing_values(survey):
+    index = FilterIndex(survey, FILTER_COLUMNS)
+    every_island = survey["Island"].dropna().unique().tolist()
+    mask = index.mask({"Island": every_island})
+    # Selecting every island still leaves out the records without an island
+    assert mask.sum() == survey["Island"].notna().sum()
+    np.testing.assert_array_equal(mask, reference_mask(survey, {"Island": every_island}))
+
+
+def test_filter_index_object_column(survey):
+    index = FilterIndex(survey, ["Family.text"])
+    selections = {"Family.text": survey["Family.text"].unique()[:4].tolist()}
+    np.testing.assert_array_equal(index.mask(selections), reference_mask(survey, selections))
+
+
+@pytest.mark.parametrize("selections", [{"Island": []}, {"Island": None}, {"Island": ["Atlantis"]},
+                                        {"Bioregion": ["Bioregión 1"], "Island": []}])
+def test_filter_index_empty_selections(survey, selections):
+    index = FilterIndex(survey, FILTER_COLUMNS)
+    assert not index.mask(selections).any()
+
+
+def test_cooccurrence_options_match_pandas(survey):
+    index = CooccurrenceIndex(survey, FILTER_COLUMNS)
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        selections = sample_selections(survey, rng)
+        for column in FILTER_COLUMNS:
+            # A value is possible when it appears with a selected value of each other column
+            expected = set(survey[column].dropna().unique().tolist())
+            for other, values in selections.items():
+                if other != column:
+                    expected &= set(survey.loc[survey[other].isin(values), column].dropna().unique().tolist())
+            options = index.options(column, selections)
+            assert set(options) == expected
+            assert options == [value for value in index.values[column] if value in expected]
+
+
+def test_cooccurrence_empty_selection(survey):
+    index = CooccurrenceIndex(survey, FILTER_COLUMNS)
+    assert index.options("Family", {"Island": []}) == []
+    assert index.options("Family", {}) == index.values["Family"]
+
+
+# Slider positions: the whole period, a few years, a single year, years without data and an inverted range
+YEAR_RANGES = [(2004, 2020), (2010, 2012), (2015, 2015), (2021, 2030), (1990, 2005), (2012, 2010)]
+
+
+@pytest.mark.parametrize("n_rows", [0, 1, 7, 8, 9, 61, 64])
+def test_range_bits_matches_packbits(n_rows):
+    rng = np.random.default_rng(n_rows)
+    for _ in range(50):
+        cuts = np.sort(rng.integers(0, n_rows + 1, 2 * rng.integers(0, 4)))
+        spans = list(zip(cuts[::2].tolist(), cuts[1::2].tolist()))
+        expected = np.zeros(n_rows, dtype=bool)
+        for start, stop in spans:
+            expected[start:stop] = True
+        np.testing.assert_array_equal(range_bits((n_rows + 7) // 8, spans), np.packbits(expected))
+
+
+@pytest.mark.parametrize("low, high", YEAR_RANGES)
+def test_partition_spans(survey, low, high):
+    partitions = PartitionOffsets(survey["year"])
+    years = survey["year"].to_numpy()
+    expected = np.flatnonzero((years >= low) & (years <= high))
+    spans = partitions.spans(range(low, high + 1))
+    # A range of years is a single slice of the sorted rows
+    assert len(spans) <= 1
+    assert [row for start, stop in spans for row in range(start, stop)] == expected.tolist()
+    assert partitions.spans(list(range(low, high + 1))) == spans
+
+
+@pytest.mark.parametrize("low, high", YEAR_RANGES)
+def test_year_ranges_match_isin(survey, low, high):
+    years = range(low, high + 1)
+    partitions = PartitionOffsets(survey["year"])
+    for selections in [{"year": years}, {"year": years, "Island": survey["Island"].dropna().unique()[:5].tolist()}]:
+        expected = reference_mask(survey, selections)
+        np.testing.assert_array_equal(FilterIndex(survey, FILTER_COLUMNS).mask(selections), expected)
+        np.testing.assert_array_equal(FilterIndex(survey, FILTER_COLUMNS, partition_column=None).mask(selections),
+                                      expected)
+        np.testing.assert_array_equal(selection_mask(survey, selections), expected)
+        np.testing.assert_array_equal(selection_mask(survey, selections, partitions), expected)
+    options = CooccurrenceIndex(survey, FILTER_COLUMNS).options("Island", {"year": years})
+    assert set(options) == set(survey.loc[survey["year"].isin(years), "Island"].dropna().unique().tolist())
+
+
+def test_year_range_cost_does_not_depend_on_its_length(survey):
+    # Only the years present in the data are looked at: a range of two billion years is still one binary search
+    huge = {"year": range(2004, 2_000_000_000)}
+    np.testing.assert_array_equal(FilterIndex(survey, FILTER_COLUMNS).mask(huge), np.ones(len(survey), dtype=bool))
+    np.testing.assert_array_equal(FilterIndex(survey, FILTER_COLUMNS, partition_column=None).mask(huge),
+                                  np.ones(len(survey), dtype=bool))
+    assert selection_mask(survey, huge, PartitionOffsets(survey["year"])).all()
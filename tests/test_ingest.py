@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_survey
+from ingest import SchemaError, ingest, normalize_categories, validate
+from loader import load_dataset
+
+
+def test_normalize_categories():
+    series = pd.Series(["Tenerife", "tenerife ", "La  Palma", "La Palma", "La palma", "Tenerife", "  ", None,
+                        "El Hierro", "el hierro", "Él Hierro", "El Hierro"], dtype=object)
+    normalized, changed = normalize_categories(series)
+    assert isinstance(normalized.dtype, pd.CategoricalDtype)
+    # The most frequent spelling of every key; blank values are missing
+    assert normalized.astype(object).where(normalized.notna(), None).tolist() == \
+        ["Tenerife", "Tenerife", "La Palma", "La Palma", "La Palma", "Tenerife", None, None,
+         "El Hierro", "El Hierro", "El Hierro", "El Hierro"]
+    assert sorted(normalized.cat.categories) == ["El Hierro", "La Palma", "Tenerife"]
+    assert changed == 6
+
+
+def test_normalize_categories_keeps_clean_values():
+    series = pd.Series(["Fría", "Caliente", "Fría"], dtype=object)
+    normalized, changed = normalize_categories(series)
+    assert normalized.astype(object).tolist() == series.tolist() and changed == 0
+
+
+def test_validate():
+    raw = synthetic_survey(200, seed=1).astype({"year": object, "Latitude": object})
+    raw.loc[[3, 4], "Latitude"] = "n/a"
+    raw.loc[5, "year"] = None
+    df, problems = validate(raw)
+    assert len(df) == 199 and df["year"].dtype == np.int64
+    assert df["Latitude"].isna().sum() == 2
+    assert len(problems) == 2
+    with pytest.raises(SchemaError, match="Island"):
+        validate(raw.drop(columns="Island"))
+
+
+@pytest.mark.parametrize("extension", [".feather", ".parquet"])
+def test_ingest_round_trip(tmp_path, extension):
+    raw = synthetic_survey(3000, seed=2).astype({"Island": object})
+    expected = raw.sort_values(["year", "id"], ignore_index=True)
+    # Other spellings of the islands in a second export
+    messy = raw.iloc[2500:].copy()
+    messy["Island"] = messy["Island"].str.upper() + "  "
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    raw.iloc[:2500].to_csv(first, index=False)
+    messy.to_csv(second, index=False)
+
+    output = str(tmp_path / ("fish" + extension))
+    df, report = ingest([str(first), str(second)], output)
+    assert df["year"].is_monotonic_increasing
+    assert any(line.startswith("Spellings unified in Island") for line in report)
+
+    for years in [None, (2008, 2012)]:
+        loaded = load_dataset(output, downcast_floats=False, years=years).sort_values(["year", "id"],
+                                                                                      ignore_index=True)
+        selected = expected if years is None else expected[expected["year"].between(*years)].reset_index(drop=True)
+        assert loaded["id"].tolist() == selected["id"].tolist()
+        assert loaded["Island"].astype(object).tolist() == selected["Island"].tolist()
+        np.testing.assert_allclose(loaded["Biomass.250m2"], selected["Biomass.250m2"].round(2))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pivot
+from conftest import reference_mask
+from cube import MEASURE
+from pivot import SparsePivot, group_sums
+
+
+def reference_sums(df, mask, groups):
+    # df[mask].groupby(groups): sum of the measure (NaN as 0) and number of rows of every observed group
+    grouped = df[mask].groupby(groups, observed=True)[MEASURE]
+    return pd.DataFrame({"sum": grouped.sum(), "size": grouped.size()})
+
+
+def assert_same_sums(result, expected):
+    assert list(result.columns) == ["sum", "size"]
+    assert result.index.names == expected.index.names
+    assert result.index.astype(object).tolist() == expected.index.astype(object).tolist()
+    np.testing.assert_allclose(result["sum"].to_numpy(), expected["sum"].to_numpy(), rtol=1e-9)
+    np.testing.assert_array_equal(result["size"].to_numpy(), expected["size"].to_numpy())
+
+
+@pytest.mark.parametrize("groups", [["Island"], ["Family.text"], ["Island", "Family"], ["Family.text", "epoca"],
+                                    ["Bioregion", "Island", "ScientificName"]])
+def test_group_sums_matches_groupby(survey, groups):
+    mask = reference_mask(survey, {"year": list(range(2008, 2016)), "epoca": ["Fría"]})
+    assert_same_sums(group_sums(survey, mask, groups, {"sum": MEASURE}), reference_sums(survey, mask, groups))
+
+
+def test_group_sums_row_positions(survey):
+    positions = np.flatnonzero(reference_mask(survey, {"Bioregion": ["Bioregión 2", "Bioregión 4"]}))
+    mask = np.zeros(len(survey), dtype=bool)
+    mask[positions] = True
+    assert_same_sums(group_sums(survey, positions, ["Family"], {"sum": MEASURE}),
+                     reference_sums(survey, mask, ["Family"]))
+
+
+def test_group_sums_sparse_path(survey, monkeypatch):
+    # Above DENSE_GROUPS_LIMIT the groups are compacted with np.unique: same result
+    monkeypatch.setattr(pivot, "DENSE_GROUPS_LIMIT", 1)
+    mask = np.ones(len(survey), dtype=bool)
+    groups = ["Island", "ScientificName"]
+    assert_same_sums(group_sums(survey, mask, groups, {"sum": MEASURE}), reference_sums(survey, mask, groups))
+
+
+@pytest.mark.parametrize("groups", [["Island"], ["Island", "Family"]])
+def test_group_sums_empty_selection(survey, groups):
+    mask = np.zeros(len(survey), dtype=bool)
+    result = group_sums(survey, mask, groups, {"sum": MEASURE})
+    assert result.empty
+    assert list(result.columns) == ["sum", "size"]
+    assert list(result.index.names) == groups
+
+
+def two_way(survey, mask, rows, columns):
+    return group_sums(survey, mask, [rows, columns], {"sum": MEASURE})["sum"]
+
+
+def test_sparse_pivot_matches_crosstab(survey):
+    mask = reference_mask(survey, {"year": list(range(2004, 2010))})
+    dense = SparsePivot.from_series(two_way(survey, mask, "Island", "Family"), decimals=2).dense("Island")
+
+    selected = survey[mask]
+    expected = pd.crosstab(selected["Island"].astype(object), selected["Family"].astype(object),
+                           values=selected[MEASURE], aggfunc="sum").round(2)
+    assert dense["Island"].tolist() == sorted(expected.index)
+    assert list(dense.columns[1:]) == sorted(expected.columns)
+    expected = expected.reindex(index=dense["Island"], columns=dense.columns[1:])
+    np.testing.assert_allclose(dense.iloc[:, 1:].to_numpy(), expected.to_numpy(), rtol=1e-9)
+
+
+def test_sparse_pivot_trim(survey):
+    mask = np.ones(len(survey), dtype=bool)
+    series = two_way(survey, mask, "ScientificName", "Site")
+    full = SparsePivot.from_series(series).dense("ScientificName").set_index("ScientificName")
+
+    trimmed = SparsePivot.from_series(series).trim(5, 3).dense("ScientificName").set_index("ScientificName")
+    top_columns = full.sum().nlargest(3).index
+    assert list(trimmed.columns) == sorted(top_columns) + ["Otros"]
+    assert len(trimmed) == 6 and trimmed.index[-1] == "Otros"
+    # Folding the other rows and columns into "Otros" keeps the total
+    assert trimmed.sum().sum() == pytest.approx(full.sum().sum())
+
+    dropped = SparsePivot.from_series(series).trim(5, 3, other_label=None).dense("ScientificName")
+    assert dropped.shape == (5, 4)
+    assert "Otros" not in dropped.columns and "Otros" not in dropped["ScientificName"].tolist()
+
+
+def test_sparse_pivot_empty(survey):
+    series = two_way(survey, np.zeros(len(survey), dtype=bool), "Island", "Family")
+    dense = SparsePivot.from_series(series, decimals=2).trim(5, 3).dense("Island")
+    assert dense.empty and list(dense.columns) == ["Island"]
@@ -0,0 +1,82 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from cache import decode_state, encode_state, filter_state_key
+from conftest import reference_mask
+from streaming import arrow_schema, stream_frame
+
+READERS = {"csv": pd.read_csv, "parquet": pd.read_parquet, "feather": pd.read_feather}
+
+
+def read_stream(chunks, file_format):
+    return READERS[file_format](io.BytesIO(b"".join(chunks)))
+
+
+def assert_same_rows(result, expected):
+    # Same columns and values, whatever types the format gives back (text for the categories of a CSV file)
+    assert list(result.columns) == list(expected.columns)
+    assert len(result) == len(expected)
+    for column in expected.columns:
+        if pd.api.types.is_numeric_dtype(expected[column]):
+            np.testing.assert_allclose(result[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float))
+        else:
+            assert result[column].astype(object).where(result[column].notna(), None).tolist() == \
+                expected[column].astype(object).where(expected[column].notna(), None).tolist()
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet", "feather"])
+@pytest.mark.parametrize("chunk_rows", [1000, 7, 100_000])
+def test_stream_frame_round_trip(survey, file_format, chunk_rows):
+    mask = reference_mask(survey, {"Island": survey["Island"].dropna().unique()[:6].tolist()})
+    chunks = list(stream_frame(survey, file_format, mask, chunk_rows=chunk_rows))
+    assert_same_rows(read_stream(chunks, file_format), survey[mask])
+    if file_format != "csv":
+        # A row group or record batch per chunk, and the end of the file
+        assert len(chunks) == -(-mask.sum() // chunk_rows) + 1
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet", "feather"])
+def test_stream_frame_without_rows(survey, file_format):
+    result = read_stream(stream_frame(survey, file_format, np.zeros(len(survey), dtype=bool)), file_format)
+    assert result.empty and list(result.columns) == list(survey.columns)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "feather"])
+def test_stream_frame_text_columns(file_format):
+    # Object columns whose first chunk has no values still fit the schema of the file
+    df = pd.DataFrame({"Island": [None] * 5 + ["Tenerife", "La Palma"], "Total": np.arange(7.0)})
+    assert arrow_schema(df).field("Island").type == pa.string()
+    assert_same_rows(read_stream(stream_frame(df, file_format, chunk_rows=5), file_format), df)
+
+
+def test_state_token_round_trip():
+    key = filter_state_key("Island", True, "Family", [["B", "A"], ["Z"], ["I1"], [], ["F"]], ["Fría"], [2010, 2012],
+                           "density", True)
+    assert decode_state(encode_state(key)) == key
+
+
+@pytest.mark.parametrize("token", [encode_state(["Island"]), encode_state({"a": 1}), "not a token",
+                                   encode_state(["Island", False, None, [[]], ["Fría"], [2010, 2012]])])
+def test_malformed_state_tokens(token):
+    with pytest.raises(ValueError):
+        decode_state(token)
+
+
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_download_raw_records(app_main, file_format):
+    dataset = app_main.datasets.get("fish")
+    selections = app_main.default_state(app_main.artifacts)[0]
+    selections[2] = selections[2][:3]
+    key = filter_state_key("Island", False, None, selections, ["Fría"], [2008, 2012])
+    response = app_main.app.server.test_client().get(
+        "/download/table?dataset=fish&scope=raw&format={}&state={}".format(file_format, encode_state(key)))
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == 'attachment; filename="registros.{}"'.format(file_format)
+    _, key_selections = app_main.key_selections(key)
+    expected = dataset.data[reference_mask(dataset.data, key_selections)]
+    assert len(expected) > 0
+    assert_same_rows(read_stream([response.get_data()], file_format), expected)
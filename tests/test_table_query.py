@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from table_query import split_filter_part, table_page
+
+ISLANDS = ["Isla {}".format(i) for i in [13, 4, 7, 1, 10, 2, 5]]
+
+
+@pytest.fixture
+def table():
+    # One-variable table: the name column is a categorical with the categories in file order, not sorted
+    return pd.DataFrame({"Island": pd.Categorical(ISLANDS, categories=ISLANDS),
+                         "Biomass.250m2": [5.0, 120.5, 33.0, np.nan, 8.25, 61.0, 0.5]})
+
+
+def records(table, sort_by=None, filter_query=None, page_size=25, page_current=0):
+    data, page_count = table_page(table, page_current, page_size, sort_by, filter_query)
+    return [row["Island"] for row in data], page_count
+
+
+@pytest.mark.parametrize("part, expected", [
+    ("{Island} contains 1", ("Island", "contains", "1")),
+    ("{Island} datestartswith 20", ("Island", "datestartswith", "20")),
+    ('{Island} eq "Isla 4"', ("Island", "eq", "Isla 4")),
+    ("{Biomass.250m2} ge 8.25", ("Biomass.250m2", "ge", "8.25")),
+    ("Island", (None, None, None)),
+])
+def test_split_filter_part(part, expected):
+    assert tuple(split_filter_part(part)) == expected
+
+
+def test_sort_categories_by_text(table):
+    assert records(table, [{"column_id": "Island", "direction": "asc"}])[0] == sorted(ISLANDS)
+    assert records(table, [{"column_id": "Island", "direction": "desc"}])[0] == sorted(ISLANDS, reverse=True)
+
+
+def test_sort_numbers_with_missing_values_last(table):
+    islands, _ = records(table, [{"column_id": "Biomass.250m2", "direction": "desc"}])
+    assert islands == ["Isla 4", "Isla 2", "Isla 7", "Isla 10", "Isla 13", "Isla 5", "Isla 1"]
+
+
+@pytest.mark.parametrize("filter_query, expected", [
+    ("{Island} contains 1", ["Isla 13", "Isla 1", "Isla 10"]),
+    ("{Island} contains isla 4", ["Isla 4"]),
+    ("{Island} eq Isla 4", ["Isla 4"]),
+    ("{Island} ne Isla 4", [island for island in ISLANDS if island != "Isla 4"]),
+    # Text columns compare as text
+    ("{Island} gt Isla 4", ["Isla 7", "Isla 5"]),
+    ("{Island} le Isla 10", ["Isla 1", "Isla 10"]),
+    ("{Biomass.250m2} ge 33", ["Isla 4", "Isla 7", "Isla 2"]),
+    ("{Biomass.250m2} lt 8.25 && {Island} contains 5", ["Isla 5"]),
+    ("{Biomass.250m2} eq 8.25", ["Isla 10"]),
+    ("{Biomass.250m2} gt abc", []),
+    ("{Unknown} eq 1", ISLANDS),
+])
+def test_filters(table, filter_query, expected):
+    assert records(table, filter_query=filter_query)[0] == expected
+
+
+def test_pages(table):
+    assert records(table, page_size=3) == (ISLANDS[:3], 3)
+    assert records(table, page_size=3, page_current=2) == (ISLANDS[6:], 3)
+    # A page past the end (after filtering) shows the last one
+    assert records(table, page_size=3, page_current=5) == (ISLANDS[6:], 3)
+    assert records(table, filter_query="{Island} eq Atlantis", page_size=3) == ([], 1)
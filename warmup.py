@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+from cache import decode_state, encode_state
+
+logger = logging.getLogger(__name__)
+
+# Number of distinct filter states kept in the log file (the most requested ones)
+LOG_SIZE = 500
+# Views recorded by a process between two saves of the log (in a background thread, the request does not wait)
+SAVE_EVERY = 50
+
+
+class StateLog:
+    # Number of times each filter state was requested, saved as JSON so it survives restarts. The file is shared by
+    # the app processes: every save adds the counts of this process since its previous save to the ones in the file.
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = Counter()
+        self.recorded = 0
+        self._lock = threading.Lock()
+        # One save at a time, so that two saves of this process do not overwrite each other's counts
+        self._save_lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return Counter(json.load(f))
+        except FileNotFoundError:
+            return Counter()
+        except (OSError, ValueError):
+            logger.warning("Unreadable filter state log %s", self.path)
+            return Counter()
+
+    def record(self, key):
+        with self._lock:
+            self.pending[encode_state(key)] += 1
+            self.recorded += 1
+            due = self.recorded % SAVE_EVERY == 0
+        if due:
+            threading.Thread(target=self.save, daemon=True).start()
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                pending, self.pending = self.pending, Counter()
+            if not pending:
+                return
+            counts = self.read()
+            counts.update(pending)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                # Write then rename, so that a process never reads a half-written file
+                tmp_file = self.path + ".{}.tmp".format(os.getpid())
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(dict(counts.most_common(LOG_SIZE)), f)
+                os.replace(tmp_file, self.path)
+            except OSError:
+                logger.warning("Could not save the filter state log to %s", self.path)
+
+    def most_frequent(self, n):
+        # The n most requested filter state keys (states that cannot be decoded are skipped)
+        counts = self.read()
+        with self._lock:
+            counts.update(self.pending)
+        keys = []
+        for token, _ in counts.most_common():
+            if len(keys) == n:
+                break
+            try:
+                keys.append(decode_state(token))
+            except (ValueError, TypeError):
+                continue
+        return keys
+
+
+def warm_up(keys, compute):
+    # Runs compute (which caches the view, see main.get_view) once for every distinct key, in order
+    start = time.perf_counter()
+    keys = list(dict.fromkeys(keys))
+    for key in keys:
+        compute(key)
+    logger.info("Warm-up: %d views in %.1f s", len(keys), time.perf_counter() - start)
+    return len(keys)